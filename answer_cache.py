@@ -0,0 +1,164 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+
+ANSWER_CACHE_PATH = "./chroma_store/answer_cache.sqlite3"
+
+
+def normalize_query(query):
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+class AnswerCache:
+    """
+    Persistent cache of structured assessments.
+    Exact hits are keyed on (normalized query, model, prompt template hash, corpus version);
+    near-duplicate hits are the nearest cached query embedding with cosine similarity
+    >= `similarity_threshold` under the same model, template and corpus version.
+    Entries expire after `ttl_seconds`, the least recently used are evicted beyond
+    `max_entries`, and everything from an older corpus version is dropped automatically.
+    """
+
+    def __init__(self, path=ANSWER_CACHE_PATH, max_entries=2000, ttl_seconds=7 * 24 * 3600, similarity_threshold=0.97):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY,
+                scope TEXT NOT NULL,
+                corpus_version TEXT NOT NULL,
+                embedding BLOB,
+                answer TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_scope ON answers (scope)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_last_access ON answers (last_access)")
+        self._conn.commit()
+        self._corpus_version = None
+        self._matrices = {}   # scope -> (keys, normalized embedding matrix)
+
+    @staticmethod
+    def _scope(model, template_hash, corpus_version):
+        return f"{model}|{template_hash}|{corpus_version}"
+
+    def _key(self, query, scope):
+        return hashlib.sha256(f"{scope}|{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+    def _check_corpus_version(self, corpus_version):
+        if corpus_version != self._corpus_version:
+            self._conn.execute("DELETE FROM answers WHERE corpus_version != ?", (corpus_version,))
+            self._conn.commit()
+            self._corpus_version = corpus_version
+            self._matrices.clear()
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl_seconds
+        deleted = self._conn.execute("DELETE FROM answers WHERE created < ?", (cutoff,)).rowcount
+        # Commit right away so a lookup that misses does not leave a write transaction open
+        self._conn.commit()
+        if deleted:
+            self._matrices.clear()
+
+    def _nearest(self, scope, query_embedding):
+        if scope not in self._matrices:
+            rows = self._conn.execute(
+                "SELECT key, embedding FROM answers WHERE scope = ? AND embedding IS NOT NULL", (scope,)
+            ).fetchall()
+            keys = [key for key, _ in rows]
+            matrix = np.array([np.frombuffer(blob, dtype=np.float32) for _, blob in rows]) if rows else None
+            if matrix is not None:
+                matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+            self._matrices[scope] = (keys, matrix)
+
+        keys, matrix = self._matrices[scope]
+        if matrix is None:
+            return None
+        vector = np.asarray(query_embedding, dtype=np.float32).ravel()
+        similarities = matrix @ (vector / (np.linalg.norm(vector) + 1e-12))
+        best = int(np.argmax(similarities))
+        return keys[best] if similarities[best] >= self.similarity_threshold else None
+
+    def _add_to_matrix(self, scope, key, embedding):
+        """Adds (or replaces) one row in the scope's loaded matrix instead of reloading it."""
+        if embedding is None or scope not in self._matrices:
+            return
+        keys, matrix = self._matrices[scope]
+        vector = np.frombuffer(embedding, dtype=np.float32)
+        vector = (vector / (np.linalg.norm(vector) + 1e-12))[None, :]
+        if key in keys:
+            matrix[keys.index(key)] = vector
+        elif matrix is None:
+            self._matrices[scope] = ([key], vector)
+        else:
+            self._matrices[scope] = (keys + [key], np.vstack([matrix, vector]))
+
+    def get(self, query, model, template_hash, corpus_version, query_embedding=None):
+        """Cached answer for this query (exact or near-duplicate), or None."""
+        scope = self._scope(model, template_hash, corpus_version)
+        with self._lock:
+            self._check_corpus_version(corpus_version)
+            self._expire()
+            key = self._key(query, scope)
+            row = self._conn.execute("SELECT answer FROM answers WHERE key = ?", (key,)).fetchone()
+            if row is None and query_embedding is not None:
+                key = self._nearest(scope, query_embedding)
+                row = key and self._conn.execute("SELECT answer FROM answers WHERE key = ?", (key,)).fetchone()
+            if not row:
+                return None
+            self._conn.execute("UPDATE answers SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return json.loads(row[0])
+
+    def put(self, query, model, template_hash, corpus_version, answer, query_embedding=None):
+        scope = self._scope(model, template_hash, corpus_version)
+        embedding = None
+        if query_embedding is not None:
+            embedding = np.asarray(query_embedding, dtype=np.float32).ravel().tobytes()
+        now = time.time()
+        with self._lock:
+            self._check_corpus_version(corpus_version)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self._key(query, scope), scope, corpus_version, embedding, json.dumps(answer), now, now),
+            )
+            evicted = self._conn.execute(
+                """DELETE FROM answers WHERE key IN (
+                    SELECT key FROM answers ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,),
+            ).rowcount
+            self._conn.commit()
+            if evicted:
+                self._matrices.clear()
+            else:
+                self._add_to_matrix(scope, self._key(query, scope), embedding)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+            self._matrices.clear()
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCache:
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = AnswerCache()
+        return _default_cache
@@ -1,27 +1,46 @@
 import os
-from typing import Iterator, Dict, Any, Optional
+from typing import Dict, Any, Optional
 import time
-import json
-import ast
+import uuid
+import threading
 
 import streamlit as st
-from pypdf import PdfReader
 
 import vector_db_querying as vdb
 import text_extraction
-
-# get rag_chunks json
+import assessment
+import document_scan
+import llm_scheduler
+import pdf_extraction
+import session_index
+import tracing
+import warmup
+from assessment import LLM_MODEL
+from retrieval_filters import RetrievalFilter
+
+# Warm heavy resources (corpus sync, Chroma, models) in the background once per process,
+# so the page renders immediately; a request that arrives first waits for the corpus.
+# The numpy vector index is only loaded when it is the configured backend.
 @st.cache_resource
-def get_rag_chunks():
-    return text_extraction.create_rag_chunks()
+def start_warm_up():
+    skip = {"imports"} if vdb.VECTOR_BACKEND == "numpy" else {"imports", "numpy index"}
+    thread = threading.Thread(target=warmup.warm_up, kwargs={"skip": skip}, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+start_warm_up()
 
-# spin up database
+# Optional /metrics (Prometheus text) and /traces endpoints, enabled with METRICS_PORT
 @st.cache_resource
-def get_collection():
-    return vdb.set_up_chromadb()
+def start_metrics_server():
+    return tracing.serve_metrics(tracing.METRICS_PORT) if tracing.METRICS_PORT else None
+
+start_metrics_server()
 
-get_rag_chunks()
-collection, documents = get_collection()
+def get_search_resources():
+    """(collection, documents), ingesting first if the corpus is stale."""
+    with st.spinner("Preparing the policy corpus…"):
+        return warmup.search_resources()
 
 # --- Page config ---
 st.set_page_config(page_title="Policy Checker Chatbot", page_icon="✅", layout="wide")
@@ -30,84 +49,55 @@ st.set_page_config(page_title="Policy Checker Chatbot", page_icon="✅", layout=
 @st.cache_data
 def extract_text_from_pdf(uploaded_file) -> str:
     """Extracts text from a PDF file."""
-    text = ""
-    reader = PdfReader(uploaded_file)
-    for page in reader.pages:
-        text += page.extract_text() + "\n\n"
-    return text
-
-def _to_dict_from_string(s: str) -> Dict[str, Any]:
-    try:
-        return json.loads(s)
-    except Exception:
-        pass
-    try:
-        start = s.find("{")
-        end = s.rfind("}")
-        if start != -1 and end != -1:
-            candidate = s[start : end + 1]
-            return json.loads(candidate)
-    except Exception:
-        pass
-    try:
-        return ast.literal_eval(s)
-    except Exception:
-        pass
-    return {"reasoning": s}
-
-def _is_valid_payload(d: Any) -> bool:
-    if not isinstance(d, dict):
-        return False
-    if not isinstance(d.get("implications"), str) or not d.get("implications").strip():
-        return False
-    results = d.get("results")
-    if not isinstance(results, list) or not results:
-        return False
-    for item in results:
-        if not isinstance(item, dict):
-            continue
-        reasoning = item.get("reasoning")
-        confidence = item.get("confidence", 0)
-        if isinstance(reasoning, str) and len(reasoning.strip()) >= 5:
-            try:
-                conf_val = float(confidence)
-            except Exception:
-                conf_val = 0.0
-            if conf_val >= 0:
-                return True
-    return False
-
-def get_ollama_json(prompt) -> Dict[str, Any]:
-    expanded_prompt = vdb.expand_abbreviations(prompt, vdb.glossary)
-    MAX_RETRIES = 2
-    for _ in range(MAX_RETRIES + 1):
-        raw = vdb.query_ollama(prompt, expanded_prompt, "gemma3", collection, documents, prompt_file_path="prompts/geo_compliance_prompt.txt")
-        data = _to_dict_from_string(raw)
-        if _is_valid_payload(data):
-            return data
-    # Last resort: return parsed best-effort
-    return data
-
-def extract_reasoning(data: Dict[str, Any]) -> str:
-    if not isinstance(data, dict):
-        return str(data)
-    if isinstance(data.get("reasoning"), str) and data.get("reasoning").strip():
-        return data["reasoning"].strip()
-    if isinstance(data.get("results"), list) and data["results"]:
-        parts = []
-        for item in data["results"]:
-            if isinstance(item, dict) and isinstance(item.get("reasoning"), str):
-                txt = item["reasoning"].strip()
-                if txt:
-                    parts.append(txt)
-        if parts:
-            return "\n\n".join(parts)
-    return json.dumps(data)
-
-def stream_chunks(text: str, chunk_size: int = 60, delay: float = 0.005) -> Iterator[str]:
-    for i in range(0, len(text), chunk_size):
-        yield text[i : i + chunk_size]
-        time.sleep(delay)
+    return pdf_extraction.extract_pdf_text(uploaded_file)
+
+def current_session_layer():
+    """Retrieval layer over this session's uploaded policies.
+    The registry may have evicted an idle session's layer; policies it no longer holds are re-indexed
+    from the texts kept in session state (content dedupe makes this free while they are still cached).
+    """
+    registry = session_index.get_session_registry()
+    for name, text in st.session_state.get("policy_texts", {}).items():
+        if (text or "").strip():
+            registry.add_policy(st.session_state.session_id, name, text)
+    return registry.get(st.session_state.session_id)
+
+def stream_ollama_json(prompt, placeholder, session_layer=None, filters=None, refresh_interval: float = 0.05) -> Dict[str, Any]:
+    """Streams the raw answer into `placeholder` as tokens arrive, then parses it.
+    If the streamed answer is not a valid payload, regenerates from the same context.
+    Answers that draw on the session's uploaded policies or a retrieval filter are not shared through the answer cache.
+    """
+    with tracing.start_trace("chat", session=st.session_state.session_id, model=LLM_MODEL), \
+            llm_scheduler.session_scope(st.session_state.session_id):
+        use_cache = not session_layer and not filters
+        query_embedding = None
+        if use_cache:
+            data, query_embedding = assessment.cached_answer(prompt)
+            if data is not None:
+                return data
+
+        collection, documents = get_search_resources()
+        llm_prompt, chunk_ids = assessment.build_llm_prompt(prompt, collection, documents, query_embedding, filters=filters,
+                                                         session_layer=session_layer)
+        tokens = []
+        last_refresh = 0.0
+        for token in vdb.stream_generate(LLM_MODEL, llm_prompt):
+            tokens.append(token)
+            now = time.monotonic()
+            if now - last_refresh >= refresh_interval:
+                placeholder.code("".join(tokens), language="json")
+                last_refresh = now
+        raw = "".join(tokens)
+        placeholder.empty()
+
+        data = assessment.to_dict_from_string(raw)
+        if not assessment.is_valid_payload(data):
+            data = assessment.generate_json(llm_prompt, LLM_MODEL, attempts=2)
+        if isinstance(data, dict):
+            data["chunk_ids"] = chunk_ids
+        if use_cache and assessment.is_valid_payload(data):
+            assessment.store_answer(prompt, data, query_embedding)
+        return data
 
 def render_model_output(data: Dict[str, Any]):
     """Render with clear headers and no numeric indices.
@@ -171,9 +161,13 @@ def render_model_output(data: Dict[str, Any]):
                 st.markdown(f"  - **Confidence:** {cval}/10")
             except Exception:
                 st.markdown(f"  - **Confidence:** {confidence}")
+        if item.get("sections"):
+            st.markdown(f"  - **Sections:** {', '.join(str(n) for n in sorted(item['sections']))}")
 
 
 # --- Session State ---
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 if "messages" not in st.session_state:
     st.session_state.messages = []  # list of {role, content, meta?}
 if "input_pdf_text_name" not in st.session_state:
@@ -186,11 +180,6 @@ if "check_prompt_shown_for" not in st.session_state:
     # Track whether the Yes/No check prompt has been shown for a given filename
     st.session_state.check_prompt_shown_for = {}
 
-for k, v in st.session_state.items():
-    print(f"{k}: {v}")
-    print("-----------------")
-print("=================================")
-
 # --- Sidebar (inputs) ---
 with st.sidebar:
     st.header("📄 File to Check:")
@@ -200,11 +189,39 @@ with st.sidebar:
     st.header("📜 Policy")
     policy_uploaded = st.file_uploader("Upload a PDF(s) of which policies you wish to refer to.", type=["pdf"], accept_multiple_files=True)
 
+    st.divider()
+    st.header("🔎 Reference laws")
+    law_metadata = text_extraction.SOURCE_METADATA.values()
+    jurisdictions = st.multiselect("Jurisdictions", sorted({m["jurisdiction"] for m in law_metadata if m.get("jurisdiction")}),
+                                   placeholder="All jurisdictions")
+    law_types = st.multiselect("Law types", sorted({m["law_type"] for m in law_metadata if m.get("law_type")}),
+                               placeholder="All law types")
+    in_force_on = None
+    if st.checkbox("Only laws in force on a date"):
+        in_force_on = st.date_input("In force on").isoformat()
+    retrieval_filter = RetrievalFilter(jurisdictions, law_types, in_force_on)
+
     st.divider()
     if st.button("Reset chat", use_container_width=True):
         st.session_state.messages = []
         st.session_state.check_prompt_shown_for = {}
 
+    with st.expander("Startup"):
+        if warmup.last_report:
+            st.code(warmup.format_report(warmup.last_report))
+        else:
+            st.caption("Warming up…")
+
+    if st.checkbox("Show request traces"):
+        for trace in tracing.get_recorder().recent(limit=5, session=st.session_state.session_id):
+            st.caption(f"{trace['name']} · {trace['seconds']:.2f} s")
+            st.dataframe(
+                [{k: v for k, v in span.items() if k != "offset"} for span in trace["spans"]],
+                use_container_width=True, hide_index=True,
+            )
+        with st.expander("Prometheus metrics"):
+            st.code(tracing.get_recorder().prometheus_text())
+
 
   
 # --- Ingest PDFs ---
@@ -232,7 +249,17 @@ if policy_uploaded is not None:
                 if policy_pdf_name not in list(st.session_state.policy_texts.keys()):
                     policy_pdf_text = extract_text_from_pdf(uploaded_file)
                     st.session_state.policy_texts[policy_pdf_name] = policy_pdf_text
-                    st.toast(f"{policy_pdf_name} uploaded", icon="✅")
+                    # Chunk + embed into this session's retrieval layer (identical content is only indexed once)
+                    if not (policy_pdf_text or "").strip():
+                        st.toast(f"No text could be extracted from {policy_pdf_name}", icon="⚠️")
+                        continue
+                    if session_index.get_session_registry().add_policy(
+                            st.session_state.session_id, policy_pdf_name, policy_pdf_text):
+                        st.toast(f"{policy_pdf_name} uploaded", icon="✅")
+                    else:
+                        st.toast(f"{policy_pdf_name} is identical to a policy already uploaded", icon="ℹ️")
+
+session_layer = current_session_layer()
 
 
 # --- Main layout ---
@@ -240,19 +267,35 @@ st.title("Policy Checker Chatbot")
 st.write("Upload a PDF or paste text, then ask the chatbot to check against your policy. Responses stream in real time.")
 
 # If no PDFs, use text fallback for a default policy
-if not st.session_state.policy_texts:
+readable_policies = [name for name, text in st.session_state.policy_texts.items() if (text or "").strip()]
+unreadable_policies = [name for name in st.session_state.policy_texts if name not in readable_policies]
+if not readable_policies:
     st.warning("⚠️ Please upload policies to be used for checking. ⚠️")
 else:
-    st.success(f"✅ Using the following documents as reference: {', '.join(st.session_state.policy_texts.keys())}")
+    st.success(f"✅ Using the following documents as reference: {', '.join(readable_policies)}")
+if unreadable_policies:
+    st.warning(f"⚠️ No text could be extracted from {', '.join(unreadable_policies)} (scanned or image-only PDF?), so it is not used.")
 
 chat_container = st.container()
 # ====================CHAT HISTORY + BUTTON FOR ACCEPTANCE===========================
 with chat_container:
     # Render stored chat history so messages persist after reruns
-    for msg in st.session_state.messages:
+    for i, msg in enumerate(st.session_state.messages):
         with st.chat_message(msg.get("role", "assistant")):
             if "content_json" in msg and isinstance(msg["content_json"], dict):
                 render_model_output(msg["content_json"])
+                # Thumbs up/down, credited to the chunks the answer was grounded in
+                if msg.get("query") and msg["content_json"].get("chunk_ids") and "rating" not in msg:
+                    up_col, down_col, _ = st.columns([1, 1, 8])
+                    rating = 0
+                    if up_col.button("👍", key=f"feedback_up_{i}"):
+                        rating = 1
+                    if down_col.button("👎", key=f"feedback_down_{i}"):
+                        rating = -1
+                    if rating:
+                        assessment.record_feedback(msg["query"], msg["content_json"], rating)
+                        msg["rating"] = rating
+                        st.toast("Thanks for the feedback", icon="✅")
             else:
                 st.markdown(msg.get("content", ""))
 
@@ -294,23 +337,29 @@ with chat_container:
                     "content": f"Check if '{file_name}' breaks any uploaded rules."
                 })
 
-                # Call the LLM, stream reasoning, then render structured output
+                # Long files are scanned section by section; short ones stream a single answer
                 with st.chat_message("assistant"):
-                    with st.spinner("Checking with policies..."):
-                        data = get_ollama_json(prompt)
-                        reasoning_text = extract_reasoning(data)
+                    if text_extraction.count_tokens(file_content) > document_scan.SECTION_TOKENS:
+                        progress_bar = st.progress(0.0, text="Scanning sections…")
+                        with tracing.start_trace("scan", session=st.session_state.session_id, model=LLM_MODEL), \
+                                llm_scheduler.session_scope(st.session_state.session_id):
+                            data = document_scan.scan_document(
+                                file_content, file_name, *get_search_resources(),
+                                progress=lambda done, total: progress_bar.progress(done / total, text=f"Scanned {done}/{total} sections"),
+                                session_layer=session_layer, filters=retrieval_filter,
+                            )
+                        progress_bar.empty()
+                    else:
                         stream_placeholder = st.empty()
-                        full_text = ""
-                        for token in stream_chunks(reasoning_text):
-                            full_text += token
-                            stream_placeholder.markdown(full_text)
-                        # After streaming, show structured view
-                        render_model_output(data)
+                        with st.spinner("Checking with policies..."):
+                            data = stream_ollama_json(prompt, stream_placeholder, session_layer, retrieval_filter)
+                    render_model_output(data)
 
                 # Persist assistant response JSON and refresh UI
                 st.session_state.messages.append({
                     "role": "assistant",
                     "content_json": data,
+                    "query": prompt,
                 })
                 st.rerun()
 
@@ -327,20 +376,16 @@ if user_query:
     st.session_state.messages.append({"role": "user", "content": user_query})
     # Stream reply and render structured output
     with st.chat_message("assistant"):
+        stream_placeholder = st.empty()
         with st.spinner("Checking with policies..."):
-            data = get_ollama_json(user_query)
-            reasoning_text = extract_reasoning(data)
-            stream_placeholder = st.empty()
-            full_text = ""
-            for token in stream_chunks(reasoning_text):
-                full_text += token
-                stream_placeholder.markdown(full_text)
-            render_model_output(data)
+            data = stream_ollama_json(user_query, stream_placeholder, session_layer, retrieval_filter)
+        render_model_output(data)
 
     # Save assistant JSON message so it's rendered on re-draw
     st.session_state.messages.append({
         "role": "assistant",
-        "content_json": data
+        "content_json": data,
+        "query": user_query,
     })
 
     # Rerun to show buttons for the last message
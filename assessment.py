@@ -0,0 +1,254 @@
+"""Compliance assessment (single queries and batches) shared by the Streamlit app, document scans and batch runs."""
+import ast
+import contextvars
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Optional
+
+import answer_cache
+import embedding_client
+import text_extraction
+import tracing
+import vector_db_querying as vdb
+
+
+LLM_MODEL = "gemma3"
+PROMPT_FILE_PATH = "prompts/geo_compliance_prompt.txt"
+
+
+# --- Parsing model output ---
+def repair_json(s: str) -> Optional[Dict[str, Any]]:
+    """Cheap local repair of a truncated or slightly malformed JSON object:
+    strips code fences and trailing commas, then closes any open string and brackets.
+    """
+    start = s.find("{")
+    if start == -1:
+        return None
+    text = s[start:].replace("```", "")
+    text = re.sub(r",\s*([}\]])", r"\1", text)
+
+    closers = []
+    in_string = False
+    escaped = False
+    for ch in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            closers.append("}" if ch == "{" else "]")
+        elif ch in "}]" and closers:
+            closers.pop()
+
+    if in_string:
+        text += '"'
+    text = re.sub(r"[,:]\s*$", "", text.rstrip())
+    text += "".join(reversed(closers))
+    try:
+        repaired = json.loads(text)
+    except Exception:
+        return None
+    return repaired if isinstance(repaired, dict) else None
+
+def to_dict_from_string(s: str) -> Dict[str, Any]:
+    try:
+        return json.loads(s)
+    except Exception:
+        pass
+    try:
+        start = s.find("{")
+        end = s.rfind("}")
+        if start != -1 and end != -1:
+            candidate = s[start : end + 1]
+            return json.loads(candidate)
+    except Exception:
+        pass
+    repaired = repair_json(s)
+    if repaired is not None:
+        return repaired
+    try:
+        return ast.literal_eval(s)
+    except Exception:
+        pass
+    return {"reasoning": s}
+
+def is_valid_payload(d: Any) -> bool:
+    if not isinstance(d, dict):
+        return False
+    if not isinstance(d.get("implications"), str) or not d.get("implications").strip():
+        return False
+    results = d.get("results")
+    if not isinstance(results, list) or not results:
+        return False
+    for item in results:
+        if not isinstance(item, dict):
+            continue
+        reasoning = item.get("reasoning")
+        confidence = item.get("confidence", 0)
+        if isinstance(reasoning, str) and len(reasoning.strip()) >= 5:
+            try:
+                conf_val = float(confidence)
+            except Exception:
+                conf_val = 0.0
+            if conf_val >= 0:
+                return True
+    return False
+
+
+# --- Answer cache ---
+def _cache_scope(model):
+    return (model, vdb.prompt_template_hash(PROMPT_FILE_PATH), text_extraction.get_corpus_version())
+
+def exact_cached_answer(prompt, model=LLM_MODEL):
+    """Cached payload stored under exactly this (normalised) prompt, or None; needs no embedding."""
+    with tracing.span("cache_lookup", exact=True) as stage:
+        data = answer_cache.get_answer_cache().get(prompt, *_cache_scope(model))
+        stage["hit"] = data is not None
+    return data
+
+def cached_answer(prompt, model=LLM_MODEL, query_embedding=None):
+    """
+    Returns (cached payload or None, query embedding) for the prompt.
+    The exact key is checked first, so a repeated prompt is answered without an embedding
+    round-trip (the returned embedding is then None); only a miss embeds for the near-duplicate search.
+    """
+    data = exact_cached_answer(prompt, model)
+    if data is not None:
+        return data, query_embedding
+    if query_embedding is None:
+        query_embedding = vdb.get_embedding(prompt)
+    return _similar_cached_answer(prompt, model, query_embedding), query_embedding
+
+def _similar_cached_answer(prompt, model, query_embedding):
+    with tracing.span("cache_lookup", exact=False) as stage:
+        data = answer_cache.get_answer_cache().get(prompt, *_cache_scope(model), query_embedding)
+        stage["hit"] = data is not None
+    return data
+
+def store_answer(prompt, data, query_embedding, model=LLM_MODEL):
+    answer_cache.get_answer_cache().put(prompt, *_cache_scope(model), data, query_embedding)
+
+
+# --- Feedback ---
+def record_feedback(prompt, data, rating, comments=""):
+    """Thumbs up (rating > 0) or down (< 0) for an answer, credited to the chunks it was grounded in."""
+    vdb.save_feedback_to_chroma({
+        "query": prompt,
+        "answer": json.dumps(data),
+        "rating": rating,
+        "comments": comments,
+        "chunk_ids": list(data.get("chunk_ids") or []) if isinstance(data, dict) else [],
+    })
+
+
+# --- Retrieval + generation ---
+def build_llm_prompt(prompt, collection, documents, query_embedding=None, filters=None, session_layer=None, tenant=None):
+    """
+    Retrieves context once and renders the full LLM prompt, so retries only re-run generation.
+    Returns (LLM prompt, ids of the chunks used as context). `tenant` selects the glossary.
+    """
+    return build_llm_prompts([prompt], collection, documents, query_embedding, filters, session_layer, tenant)[0]
+
+def build_llm_prompts(prompts, collection, documents, query_embeddings=None, filters=None, session_layer=None, tenant=None):
+    """build_llm_prompt for several prompts, with one batched retrieval and rerank."""
+    chunk_lists = vdb.retrieve_chunks_batch(prompts, collection, documents, query_embeddings=query_embeddings,
+                                            filters=filters, session_layer=session_layer)
+    built = []
+    with tracing.span("prompt_render", prompts=len(prompts)):
+        for prompt, chunks in zip(prompts, chunk_lists):
+            context = "\n\n".join(text for _, text in chunks)
+            llm_prompt = vdb.build_prompt(prompt, vdb.expand_abbreviations(prompt, tenant=tenant), context, PROMPT_FILE_PATH)
+            built.append((llm_prompt, [chunk_id for chunk_id, _ in chunks]))
+    return built
+
+def generate_json(llm_prompt, model=LLM_MODEL, attempts: int = 3) -> Dict[str, Any]:
+    """Generation-only retries over an already-built LLM prompt."""
+    data: Dict[str, Any] = {}
+    for _ in range(attempts):
+        raw = "".join(vdb.stream_generate(model, llm_prompt))
+        data = to_dict_from_string(raw)
+        if is_valid_payload(data):
+            return data
+    # Last resort: return parsed best-effort
+    return data
+
+def _finish(prompt, data, chunk_ids, query_embedding, model, use_cache):
+    if isinstance(data, dict):
+        data["chunk_ids"] = chunk_ids
+    if use_cache and is_valid_payload(data):
+        store_answer(prompt, data, query_embedding, model)
+    return data
+
+def assess(prompt, collection, documents, model=LLM_MODEL, query_embedding=None, filters=None, use_cache=True,
+           session_layer=None, tenant=None) -> Dict[str, Any]:
+    """
+    Full assessment of one feature description: cache -> retrieve -> generate (with retries).
+    Answers grounded in filters, a session's uploaded policies or a tenant glossary bypass the shared cache.
+    The payload's "chunk_ids" lists the context chunks, so feedback can be recorded against them.
+    """
+    use_cache = use_cache and not filters and not session_layer and not tenant
+    with tracing.start_trace("assess", model=model):
+        if use_cache:
+            data, query_embedding = cached_answer(prompt, model, query_embedding)
+            if data is not None:
+                return data
+        llm_prompt, chunk_ids = build_llm_prompt(prompt, collection, documents, query_embedding, filters, session_layer, tenant)
+        return _finish(prompt, generate_json(llm_prompt, model), chunk_ids, query_embedding, model, use_cache)
+
+def assess_batch(prompts, collection, documents, model=LLM_MODEL, query_embeddings=None, filters=None, use_cache=True,
+                 session_layer=None, max_workers=4, on_result=None, tenant=None):
+    """
+    assess() for several prompts: exact cache lookups, one embedding request for the rest,
+    near-duplicate lookups, one batched retrieval and rerank for the misses, then generation
+    on `max_workers` threads.
+    `on_result(index, payload)` is called (on the calling thread) as each prompt completes.
+    """
+    prompts = list(prompts)
+    with tracing.start_trace("assess_batch", model=model, items=len(prompts)):
+        use_cache = use_cache and not filters and not session_layer and not tenant
+        results = [None] * len(prompts)
+
+        def resolve(i, data):
+            results[i] = data
+            if data is not None and on_result:
+                on_result(i, data)
+
+        # Exact repeats are answered before anything is embedded
+        if use_cache:
+            for i, prompt in enumerate(prompts):
+                resolve(i, exact_cached_answer(prompt, model))
+        pending = [i for i, data in enumerate(results) if data is None]
+        if query_embeddings is None:
+            query_embeddings = [None] * len(prompts)
+            if pending:
+                with tracing.span("embed", queries=len(pending)):
+                    embedded = embedding_client.get_client().embed([prompts[i] for i in pending])
+                for i, embedding in zip(pending, embedded):
+                    query_embeddings[i] = embedding
+        if use_cache:
+            for i in pending:
+                resolve(i, _similar_cached_answer(prompts[i], model, [query_embeddings[i]]))
+
+        misses = [i for i, data in enumerate(results) if data is None]
+        if not misses:
+            return results
+        built = build_llm_prompts([prompts[i] for i in misses], collection, documents,
+                                  [query_embeddings[i] for i in misses], filters, session_layer, tenant)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            # Each worker runs in a copy of this context, so its generate spans land in this trace
+            futures = {
+                pool.submit(contextvars.copy_context().run, generate_json, llm_prompt, model): (i, chunk_ids)
+                for i, (llm_prompt, chunk_ids) in zip(misses, built)
+            }
+            for future in as_completed(futures):
+                i, chunk_ids = futures[future]
+                results[i] = _finish(prompts[i], future.result(), chunk_ids, [query_embeddings[i]], model, use_cache)
+                if on_result:
+                    on_result(i, results[i])
+        return results
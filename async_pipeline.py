@@ -0,0 +1,99 @@
+import asyncio
+
+import httpx
+
+import embedding_client
+import vector_db_querying as vdb
+
+
+class AsyncOllamaClient:
+    """
+    Pooled async HTTP client for Ollama's embed endpoint; generation goes through the shared LLM scheduler.
+    Create one per event loop and reuse it across queries (or use it as an async context manager).
+    """
+
+    def __init__(self, base_url=vdb.OLLAMA_URL, max_connections=8, timeout=300):
+        self.http = httpx.AsyncClient(
+            base_url=base_url,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(timeout, connect=10),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.http.aclose()
+
+    async def embed(self, texts, model=embedding_client.EMBED_MODEL):
+        response = await self.http.post("/api/embed", json={"model": model, "input": list(texts)})
+        response.raise_for_status()
+        return response.json()["embeddings"]
+
+    async def generate_stream(self, body):
+        """
+        Yields response tokens through the shared LLM scheduler, so async callers share its
+        concurrency limit, fair queueing and singleflight with the sync paths.
+        Cancelling the consumer stops reading; the generation still completes for any joined callers.
+        """
+        flight, _ = vdb.get_llm_scheduler().submit(body)
+        tokens = iter(flight)
+        while (token := await asyncio.to_thread(next, tokens, None)) is not None:
+            yield token
+
+
+async def aretrieve_context(query, collection, documents, client, top_k=5, alpha=0.7, beta=0.2, gamma=0.1,
+                            fusion="linear", prompt_file_path=vdb.prompt_file_path, filters=None):
+    """
+    Runs the vector stage (async embedding + Chroma query), the keyword stage and the
+    prompt template read concurrently, then fuses and reranks.
+    Returns (reranked [(chunk id, text)], prompt template).
+    """
+    n = top_k * 2
+
+    async def vector_stage():
+        query_embedding = await client.embed([query])
+        return await asyncio.to_thread(vdb.vector_candidates, query_embedding, collection, n, None, filters)
+
+    vector_hits, keyword_hits, template = await asyncio.gather(
+        vector_stage(),
+        asyncio.to_thread(vdb.keyword_candidates, query, n, filters),
+        asyncio.to_thread(vdb.load_prompt_template, prompt_file_path),
+    )
+
+    fused = vdb.fuse_candidates(vector_hits, keyword_hits, alpha, beta, gamma, fusion=fusion)[:top_k]
+    ids = [chunk_id for chunk_id, _ in fused]
+    texts = await asyncio.to_thread(vdb.lookup_documents, ids, collection, documents)
+    scores = await asyncio.to_thread(vdb.get_reranker().score, query, texts, ids)
+    order = sorted(range(len(ids)), key=lambda i: scores[i], reverse=True)
+    return [(ids[i], texts[i]) for i in order], template
+
+
+async def astream_ollama(query, expanded_query, model, collection, documents, prompt_file_path, client):
+    """Async generator of answer tokens for one query."""
+    reranked, template = await aretrieve_context(query, collection, documents, client, prompt_file_path=prompt_file_path)
+    context = "\n\n".join(text for _, text in reranked[:3])
+    prompt = template.format(query=query, expanded_query=expanded_query, context=context)
+    async for token in client.generate_stream(vdb.generation_request(model, prompt)):
+        yield token
+
+
+async def aquery_ollama(query, expanded_query, model, collection, documents, prompt_file_path, client=None):
+    """
+    Async counterpart of vector_db_querying.query_ollama.
+    Cancelling the awaiting task returns control at once and aborts the query embedding request,
+    but retrieval steps already running on worker threads finish in the background, and a
+    generation already handed to the scheduler runs to completion (other callers may have
+    joined it); its tokens are discarded.
+    """
+    if client is None:
+        async with AsyncOllamaClient() as own_client:
+            return await aquery_ollama(query, expanded_query, model, collection, documents, prompt_file_path, own_client)
+
+    output = []
+    async for token in astream_ollama(query, expanded_query, model, collection, documents, prompt_file_path, client):
+        output.append(token)
+    return "".join(output)
@@ -0,0 +1,177 @@
+"""
+Headless bulk assessment of feature artifacts.
+
+Reads feature descriptions from a JSONL or CSV file and runs each one through the same
+pipeline as the app (abbreviation expansion -> hybrid search -> rerank -> generation) on a
+pool of worker threads. Every result is appended to the output JSONL as soon as it is done,
+so the output doubles as a checkpoint: re-running the same command skips items that already
+succeeded and retries the ones that failed.
+
+    python batch_assess.py features.jsonl results.jsonl --workers 8
+    python batch_assess.py features.csv results.jsonl --id-field feature_id --text-field description
+    python batch_assess.py features.jsonl results.jsonl --jurisdiction US-CA US-FL --in-force-on 2025-06-01
+"""
+import argparse
+import csv
+import json
+import os
+import statistics
+import time
+
+import assessment
+import vector_db_querying as vdb
+import warmup
+from retrieval_filters import RetrievalFilter
+
+
+def read_items(path, id_field="id", text_field="text"):
+    """Yields (item id, text) from a JSONL or CSV file; the line/row number is the id if the field is missing."""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for n, row in enumerate(rows, start=1):
+            text = (row.get(text_field) or "").strip()
+            item_id = row.get(id_field)
+            if text:
+                yield str(n if item_id in (None, "") else item_id), text
+
+
+def completed_ids(output_path):
+    """Ids already assessed successfully in a previous (possibly interrupted) run."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue   # a line cut off by an interruption
+            if not record.get("error"):
+                done.add(record["id"])
+    return done
+
+
+def _ends_mid_line(path):
+    """True if `path` exists and its last line was cut off (no trailing newline)."""
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return False
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b"\n"
+
+
+def _assess_item(item_id, text, collection, documents, model, use_cache, tenant=None, filters=None):
+    start = time.perf_counter()
+    try:
+        result = assessment.assess(text, collection, documents, model, filters=filters, use_cache=use_cache, tenant=tenant)
+        error = None
+    except Exception as e:
+        result, error = None, f"{type(e).__name__}: {e}"
+    return {"id": item_id, "result": result, "error": error, "seconds": time.perf_counter() - start}
+
+
+def run_batch(input_path, output_path, workers=4, model=assessment.LLM_MODEL, id_field="id", text_field="text",
+              embed_batch=32, use_cache=True, progress=None, tenant=None, filters=None):
+    """
+    Assesses every not-yet-completed item and appends results to `output_path`.
+    Items are processed `embed_batch` at a time through assessment.assess_batch (one embedding
+    request and one batched retrieval + rerank per batch, generation on `workers` threads), so
+    memory stays flat for large inputs. Per-item latency is measured from the start of its batch.
+    If a batch fails, its unfinished items are retried one by one so a bad item only fails itself.
+    `tenant` selects a tenant glossary for abbreviation expansion and `filters` (a RetrievalFilter)
+    restricts the reference laws. Generations go through the
+    shared LLM scheduler, whose concurrency limit is raised to `workers` for the run.
+    Returns the per-item latencies (seconds), the error count and the wall time.
+    """
+    collection, documents = warmup.search_resources()
+    # Otherwise LLM_MAX_CONCURRENCY would silently cap the worker threads' generations
+    vdb.get_llm_scheduler().raise_concurrency(workers)
+    done = completed_ids(output_path)
+    pending = ((item_id, text) for item_id, text in read_items(input_path, id_field, text_field) if item_id not in done)
+
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    with open(output_path, "a", encoding="utf-8") as out:
+        if _ends_mid_line(output_path):
+            out.write("\n")   # keep the first new record off an interrupted run's partial line
+
+        def write(record):
+            nonlocal errors
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            latencies.append(record["seconds"])
+            errors += bool(record["error"])
+            if progress:
+                progress(len(latencies), errors)
+
+        while True:
+            batch = [item for _, item in zip(range(embed_batch), pending)]
+            if not batch:
+                break
+            batch_start = time.perf_counter()
+            written = set()
+
+            def on_result(index, data):
+                written.add(index)
+                write({"id": batch[index][0], "result": data, "error": None, "seconds": time.perf_counter() - batch_start})
+
+            try:
+                assessment.assess_batch([text for _, text in batch], collection, documents, model,
+                                        filters=filters, use_cache=use_cache, max_workers=workers,
+                                        on_result=on_result, tenant=tenant)
+            except Exception:
+                for index, (item_id, text) in enumerate(batch):
+                    if index not in written:
+                        write(_assess_item(item_id, text, collection, documents, model, use_cache, tenant, filters))
+
+    return latencies, errors, time.perf_counter() - start
+
+
+def format_report(latencies, errors, wall_seconds):
+    if not latencies:
+        return "Nothing to assess (all items already completed)."
+    ordered = sorted(latencies)
+    p95 = ordered[max(0, int(len(ordered) * 0.95) - 1)]
+    throughput = len(latencies) / wall_seconds if wall_seconds else 0.0
+    return "\n".join([
+        f"items      {len(latencies)} ({errors} failed)",
+        f"wall time  {wall_seconds:.1f} s",
+        f"throughput {throughput:.2f} items/s ({throughput * 3600:.0f} items/h)",
+        f"latency    mean {statistics.mean(ordered):.2f} s   p50 {statistics.median(ordered):.2f} s   "
+        f"p95 {p95:.2f} s   max {ordered[-1]:.2f} s",
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL or CSV file of feature artifacts")
+    parser.add_argument("output", help="JSONL results file (also the resume checkpoint)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--model", default=assessment.LLM_MODEL)
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--text-field", default="text")
+    parser.add_argument("--embed-batch", type=int, default=32, help="items per batched embedding/retrieval call")
+    parser.add_argument("--tenant", help="tenant glossary (data_sources/terminology/<tenant>.json) to expand terms with")
+    parser.add_argument("--jurisdiction", nargs="+", help="only use laws of these jurisdictions (e.g. EU US-CA)")
+    parser.add_argument("--law-type", nargs="+", help="only use laws of these types (e.g. ChildProtection)")
+    parser.add_argument("--in-force-on", help="only use laws in force on this date (YYYY-MM-DD)")
+    parser.add_argument("--no-cache", action="store_true", help="always regenerate instead of using cached answers")
+    args = parser.parse_args()
+
+    def progress(n, errors):
+        if n % 25 == 0:
+            print(f"{n} assessed ({errors} failed)", flush=True)
+
+    latencies, errors, wall_seconds = run_batch(
+        args.input, args.output, args.workers, args.model, args.id_field, args.text_field,
+        args.embed_batch, not args.no_cache, progress, args.tenant,
+        RetrievalFilter(args.jurisdiction, args.law_type, args.in_force_on) or None,
+    )
+    print(format_report(latencies, errors, wall_seconds))
+
+
+if __name__ == "__main__":
+    main()
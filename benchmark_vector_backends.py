@@ -0,0 +1,78 @@
+"""
+Compares the Chroma and in-process NumPy vector backends on latency and recall.
+
+Queries are sampled from the ingested chunk embeddings (with a little noise so they are
+not exact copies). Exact NumPy search is the ground truth for recall@k.
+
+    python benchmark_vector_backends.py --queries 200 --k 10
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+import chunk_store
+import vector_db_querying as vdb
+from vector_index import ChromaBackend, NumpyVectorIndex
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def _summary(name, latencies_ms):
+    latencies_ms = sorted(latencies_ms)
+    p95 = latencies_ms[max(0, int(len(latencies_ms) * 0.95) - 1)]
+    return f"{name:<16} mean {statistics.mean(latencies_ms):8.3f} ms   p50 {statistics.median(latencies_ms):8.3f} ms   p95 {p95:8.3f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=32, help="queries per batched NumPy call")
+    parser.add_argument("--noise", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    store = chunk_store.ChunkStore.open()
+    if store is None or not len(store):
+        raise SystemExit("No chunk store found; run ingestion first.")
+
+    rng = np.random.default_rng(args.seed)
+    rows = rng.choice(len(store), size=min(args.queries, len(store)), replace=False)
+    queries = np.asarray(store.embeddings[rows], dtype=np.float32)
+    queries += rng.normal(scale=args.noise * float(np.abs(queries).mean()), size=queries.shape).astype(np.float32)
+
+    numpy_index, build_ms = _timed(NumpyVectorIndex.from_chunk_store, store)
+    chroma = ChromaBackend(vdb.get_collection())
+
+    exact, numpy_ms, chroma_ms, recalls = [], [], [], []
+    for query in queries:
+        truth, ms = _timed(numpy_index.query, query, args.k)
+        numpy_ms.append(ms)
+        exact.append({chunk_id for chunk_id, _ in truth[0]})
+
+        hits, ms = _timed(chroma.query, query, args.k)
+        chroma_ms.append(ms)
+        recalls.append(len(exact[-1] & {chunk_id for chunk_id, _ in hits[0]}) / max(1, len(exact[-1])))
+
+    batched_ms = []
+    for start in range(0, len(queries), args.batch):
+        batch = queries[start : start + args.batch]
+        _, ms = _timed(numpy_index.query, batch, args.k)
+        batched_ms.append(ms / len(batch))
+
+    print(f"Corpus: {len(store)} chunks x {store.dim} dims, {len(queries)} queries, k={args.k}")
+    print(f"NumPy index build: {build_ms:.1f} ms")
+    print(_summary("numpy", numpy_ms))
+    print(_summary(f"numpy batch={args.batch}", batched_ms) + "   (per query)")
+    print(_summary("chroma", chroma_ms))
+    print(f"Chroma recall@{args.k} vs exact: {statistics.mean(recalls):.4f}")
+
+
+if __name__ == "__main__":
+    main()
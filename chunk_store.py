@@ -0,0 +1,181 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+
+CHUNK_STORE_PATH = "chunk_store"
+EMBEDDING_DTYPE = "float32"
+
+# Fields shared by every chunk of a document; stored once per document
+DOC_FIELDS = ("source", "title", "publisher", "jurisdiction", "law_type", "effective_date", "url", "language", "tags")
+
+TABLE_FILE = "table.json"
+EMBEDDINGS_FILE = "embeddings.bin"
+TEXTS_FILE = "texts.bin"
+OFFSETS_FILE = "offsets.npy"
+
+
+class ChunkStoreWriter:
+    """
+    Streams chunk records into a columnar store directory:
+      embeddings.bin  row-major float32/float16 matrix, one row per chunk
+      texts.bin       UTF-8 chunk texts back to back, sliced by offsets.npy
+      table.json      chunk ids/hashes/pages, the per-document metadata table, and the matrix shape
+    Files are written under `<path>.tmp` and swapped into place on close().
+    """
+
+    def __init__(self, path=CHUNK_STORE_PATH, dtype=EMBEDDING_DTYPE):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.dtype = np.dtype(dtype)
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self._embeddings = open(os.path.join(self.tmp_path, EMBEDDINGS_FILE), "wb")
+        self._texts = open(os.path.join(self.tmp_path, TEXTS_FILE), "wb")
+        self.dim = 0
+        self.offsets = [0]
+        self.documents = []
+        self._doc_index = {}
+        self.columns = {"ids": [], "chunk_hashes": [], "doc": [], "page_start": [], "page_end": []}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def append(self, records):
+        for record in records:
+            embedding = np.asarray(record["embedding"], dtype=self.dtype).ravel()
+            if not self.dim:
+                self.dim = embedding.shape[0]
+            elif embedding.shape[0] != self.dim:
+                raise ValueError(f"Embedding has dimension {embedding.shape[0]}, store has {self.dim}")
+            self._embeddings.write(embedding.tobytes())
+
+            text = record["text"].encode("utf-8")
+            self._texts.write(text)
+            self.offsets.append(self.offsets[-1] + len(text))
+
+            source = record["source"]
+            if source not in self._doc_index:
+                self._doc_index[source] = len(self.documents)
+                self.documents.append({field: record.get(field) for field in DOC_FIELDS})
+
+            self.columns["ids"].append(record["id"])
+            self.columns["chunk_hashes"].append(record["chunk_hash"])
+            self.columns["doc"].append(self._doc_index[source])
+            self.columns["page_start"].append(record.get("page_start"))
+            self.columns["page_end"].append(record.get("page_end"))
+
+    def close(self):
+        self._embeddings.close()
+        self._texts.close()
+        np.save(os.path.join(self.tmp_path, OFFSETS_FILE), np.asarray(self.offsets, dtype=np.int64))
+        table = {
+            "dtype": self.dtype.name,
+            "dim": self.dim,
+            "count": len(self.columns["ids"]),
+            "documents": self.documents,
+            **self.columns,
+        }
+        with open(os.path.join(self.tmp_path, TABLE_FILE), "w", encoding="utf-8") as f:
+            json.dump(table, f, ensure_ascii=False, separators=(",", ":"))
+
+        old_path = self.path + ".old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(self.path):
+            os.rename(self.path, old_path)
+        os.rename(self.tmp_path, self.path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    def abort(self):
+        self._embeddings.close()
+        self._texts.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+
+class ChunkStore:
+    """
+    Read side of the columnar store. The embedding matrix and texts are memory-mapped,
+    so opening the store costs only the (small) table.json parse.
+    """
+
+    def __init__(self, path=CHUNK_STORE_PATH):
+        self.path = path
+        with open(os.path.join(path, TABLE_FILE), "r", encoding="utf-8") as f:
+            self.table = json.load(f)
+        self.ids = self.table["ids"]
+        self.documents = self.table["documents"]
+        self.count = self.table["count"]
+        self.dim = self.table["dim"]
+
+        if self.count and self.dim:
+            self.embeddings = np.memmap(os.path.join(path, EMBEDDINGS_FILE), dtype=self.table["dtype"],
+                                        mode="r", shape=(self.count, self.dim))
+        else:
+            self.embeddings = np.zeros((0, self.dim), dtype=self.table["dtype"])
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        texts_path = os.path.join(path, TEXTS_FILE)
+        self._texts = np.memmap(texts_path, dtype=np.uint8, mode="r") if os.path.getsize(texts_path) else b""
+        self._rows_by_hash = None
+        self._rows_by_id = None
+
+    @classmethod
+    def open(cls, path=CHUNK_STORE_PATH):
+        """The store at `path`, or None if nothing has been ingested yet."""
+        if not os.path.exists(os.path.join(path, TABLE_FILE)):
+            return None
+        return cls(path)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        """
+        Drops the memory maps so the store's files can be replaced (Windows refuses to rename
+        mapped files). Rows read earlier stay valid; the store must not be read afterwards.
+        """
+        self.embeddings = np.zeros((0, self.dim), dtype=self.table["dtype"])
+        self.offsets = None
+        self._texts = b""
+
+    def text(self, row):
+        return bytes(self._texts[self.offsets[row] : self.offsets[row + 1]]).decode("utf-8")
+
+    def document(self, row):
+        return self.documents[self.table["doc"][row]]
+
+    def row_for_hash(self, chunk_hash):
+        if self._rows_by_hash is None:
+            self._rows_by_hash = {h: row for row, h in enumerate(self.table["chunk_hashes"])}
+        return self._rows_by_hash.get(chunk_hash)
+
+    def row_for_id(self, chunk_id):
+        if self._rows_by_id is None:
+            self._rows_by_id = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        return self._rows_by_id.get(chunk_id)
+
+    def embedding(self, row):
+        # A copy, so no caller keeps the memory map alive
+        return np.array(self.embeddings[row], dtype=np.float32)
+
+    def record(self, row):
+        """The chunk as a plain dict, in the same shape ingestion produces."""
+        record = {"text": self.text(row), **self.document(row)}
+        if self.table["page_start"][row] is not None:
+            record["page_start"] = self.table["page_start"][row]
+            record["page_end"] = self.table["page_end"][row]
+        record["chunk_hash"] = self.table["chunk_hashes"][row]
+        record["id"] = self.ids[row]
+        record["embedding"] = self.embedding(row).tolist()
+        return record
+
+    def iter_records(self):
+        for row in range(self.count):
+            yield self.record(row)
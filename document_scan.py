@@ -0,0 +1,125 @@
+"""Section-by-section compliance scan for long uploaded documents."""
+import assessment
+import text_extraction
+import vector_db_querying as vdb
+
+
+# Upper bound on the size of each assessed section, in embedding-model tokens
+SECTION_TOKENS = 400
+SCAN_WORKERS = 4
+# Reranked chunks placed in each section's prompt (see vdb.retrieve_chunks)
+CONTEXT_CHUNKS = 3
+# Glossary expansion makes {expanded_query} longer than the section itself
+EXPANSION_ALLOWANCE = 1.5
+
+_IMPLICATION_RANK = {"required": 2, "insufficient": 1, "not required": 0}
+
+
+def split_sections(text, max_tokens=SECTION_TOKENS):
+    """Token-bounded sections without overlap; headings start new sections where possible."""
+    return [section for section, _, _ in text_extraction.chunk_pages([(1, text)], max_tokens, overlap=0)]
+
+
+def section_prompt(file_name, section, index, total):
+    return (
+        f"Check the following section of a file against the uploaded policy rules. "
+        f"State if it breaks any rules, and explain why or why not.\n\n"
+        f"File: {file_name} (section {index} of {total})\n"
+        f"Content:\n{section}\n\n"
+    )
+
+
+def section_token_budget(file_name, prompt_file_path=assessment.PROMPT_FILE_PATH):
+    """
+    Largest section whose prompt still fits the LLM context. The template repeats {query}
+    and {expanded_query} (each carrying the whole section) and {context}, so each counts
+    once per occurrence.
+    """
+    template = vdb.load_prompt_template(prompt_file_path)
+    wrapper = text_extraction.count_tokens(section_prompt(file_name, "", 1, 1))
+    n_query = template.count("{query}")
+    n_expanded = template.count("{expanded_query}")
+    fixed = (text_extraction.count_tokens(template)
+             + template.count("{context}") * CONTEXT_CHUNKS * text_extraction.MAX_CHUNK_TOKENS
+             + (n_query + n_expanded) * wrapper)
+    per_section_token = n_query + n_expanded * EXPANSION_ALLOWANCE
+    available = vdb.prompt_token_budget() - fixed
+    if available < per_section_token * 50:
+        raise ValueError(f"LLM_NUM_CTX={vdb.LLM_NUM_CTX} leaves no room for document sections in {prompt_file_path}")
+    return int(available / max(per_section_token, 1))
+
+
+def _implication_rank(value):
+    value = (value or "").strip().lower()
+    for key, rank in _IMPLICATION_RANK.items():
+        if value.startswith(key):
+            return rank
+    return -1
+
+
+def _confidence(item):
+    try:
+        return float(item.get("confidence", 0))
+    except Exception:
+        return 0.0
+
+
+def merge_findings(section_results):
+    """
+    Merges per-section payloads into one report.
+    Implications take the most severe section verdict; results are grouped by law,
+    keeping the most confident finding and listing every section that triggered it.
+    """
+    implications = ""
+    by_law = {}
+    for index, data in enumerate(section_results, start=1):
+        if not isinstance(data, dict):
+            continue
+        if _implication_rank(data.get("implications")) > _implication_rank(implications):
+            implications = data.get("implications")
+        for item in data.get("results") or []:
+            if not isinstance(item, dict):
+                continue
+            key = (item.get("law") or "").strip().lower()
+            current = by_law.get(key)
+            if current is None or _confidence(item) > _confidence(current):
+                sections = current["sections"] if current else []
+                current = {**item, "sections": sections}
+                by_law[key] = current
+            if index not in current["sections"]:
+                current["sections"].append(index)
+
+    chunk_ids = list(dict.fromkeys(
+        chunk_id for data in section_results if isinstance(data, dict) for chunk_id in data.get("chunk_ids") or []
+    ))
+    results = sorted(by_law.values(), key=_confidence, reverse=True)
+    return {"implications": implications or "Insufficient", "results": results, "sections_scanned": len(section_results),
+            "chunk_ids": chunk_ids}
+
+
+def scan_document(text, file_name, collection, documents, model=assessment.LLM_MODEL, max_workers=SCAN_WORKERS,
+                  section_tokens=SECTION_TOKENS, progress=None, session_layer=None, filters=None):
+    """
+    Splits `text` into sections and assesses them as one batch: a single embedding request,
+    one batched retrieval and rerank, then generation on `max_workers` threads, and merges
+    the findings. `progress(done, total)` is called as sections complete. Every section is
+    assessed; nothing is truncated: sections are shrunk below `section_tokens` when needed so
+    each prompt fits the LLM context. `session_layer` adds the session's uploaded policies to retrieval
+    and `filters` (a RetrievalFilter) restricts the reference laws.
+    """
+    sections = split_sections(text, min(section_tokens, section_token_budget(file_name)))
+    if not sections:
+        return {"implications": "Insufficient", "results": [], "sections_scanned": 0}
+
+    prompts = [section_prompt(file_name, section, i, len(sections)) for i, section in enumerate(sections, start=1)]
+    done = 0
+
+    def on_result(index, data):
+        nonlocal done
+        done += 1
+        if progress:
+            progress(done, len(prompts))
+
+    results = assessment.assess_batch(prompts, collection, documents, model, max_workers=max_workers,
+                                      filters=filters, session_layer=session_layer, on_result=on_result)
+    return merge_findings(results)
@@ -0,0 +1,106 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+OLLAMA_URL = "http://localhost:11434"
+EMBED_MODEL = "mxbai-embed-large"
+
+# Status codes worth retrying: Ollama answers 503 while a model is loading.
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class EmbeddingClient:
+    """
+    Batched client for Ollama's /api/embed endpoint.
+    Texts are sent `batch_size` at a time over one keep-alive session, with up to
+    `max_in_flight` batches running concurrently. Failed batches are retried with
+    exponential backoff.
+    """
+
+    def __init__(self, base_url=OLLAMA_URL, model=EMBED_MODEL, batch_size=64,
+                 max_in_flight=4, max_retries=3, backoff=0.5, timeout=120):
+        self.url = base_url.rstrip("/") + "/api/embed"
+        self.model = model
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _executor(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="embed")
+            return self._pool
+
+    def _post(self, inputs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.post(
+                    self.url,
+                    json={"model": self.model, "input": inputs},
+                    timeout=self.timeout,
+                )
+                if response.status_code in RETRYABLE_STATUS:
+                    raise requests.HTTPError(f"{response.status_code} from {self.url}", response=response)
+                response.raise_for_status()
+                embeddings = response.json()["embeddings"]
+                if len(embeddings) != len(inputs):
+                    raise ValueError(f"Expected {len(inputs)} embeddings, got {len(embeddings)}")
+                return embeddings
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                retryable = not isinstance(e, requests.HTTPError) or (
+                    e.response is not None and e.response.status_code in RETRYABLE_STATUS
+                )
+                if not retryable or attempt == self.max_retries:
+                    raise
+                time.sleep(self.backoff * (2 ** attempt))
+
+    def embed(self, texts):
+        """Returns one embedding per input text, in input order."""
+        texts = list(texts)
+        if not texts:
+            return []
+        batches = [texts[i : i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1:
+            return self._post(batches[0])
+
+        embeddings = []
+        for batch_embeddings in self._executor().map(self._post, batches):
+            embeddings.extend(batch_embeddings)
+        return embeddings
+
+    def embed_one(self, text):
+        return self.embed([text])[0]
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
+        self.session.close()
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_client() -> EmbeddingClient:
+    """Process-wide client shared by ingestion and querying."""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = EmbeddingClient()
+        return _default_client
@@ -0,0 +1,79 @@
+import atexit
+import sqlite3
+import threading
+import time
+
+
+FEEDBACK_INDEX_PATH = "./chroma_store/feedback_scores.sqlite3"
+
+
+class FeedbackIndex:
+    """
+    Per-chunk feedback table: thumbs up/down counts for every chunk that was used in a rated answer.
+    Scores live in an in-memory dict (O(1) lookup during fusion) and are updated on every
+    rating; changed rows are written back to SQLite in batches of `flush_every` or after
+    `flush_interval` seconds. A chunk's score is (up - down) / (up + down + prior), in (-1, 1),
+    and 0 for chunks nobody has rated.
+    """
+
+    def __init__(self, path=FEEDBACK_INDEX_PATH, prior=2.0, flush_every=32, flush_interval=5.0):
+        self.prior = prior
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS chunk_feedback (
+                chunk_id TEXT PRIMARY KEY,
+                up INTEGER NOT NULL,
+                down INTEGER NOT NULL
+            )"""
+        )
+        self._conn.commit()
+        self._counts = {chunk_id: [up, down] for chunk_id, up, down in self._conn.execute("SELECT * FROM chunk_feedback")}
+        self.scores = {chunk_id: self._score(up, down) for chunk_id, (up, down) in self._counts.items()}
+        self._dirty = set()
+        self._last_flush = time.monotonic()
+
+    def _score(self, up, down):
+        return (up - down) / (up + down + self.prior)
+
+    def score(self, chunk_id):
+        return self.scores.get(chunk_id, 0.0)
+
+    def record(self, chunk_ids, rating):
+        """Adds one rating (> 0 thumbs up, < 0 thumbs down) to each chunk that fed the answer."""
+        if not rating:
+            return
+        with self._lock:
+            for chunk_id in set(chunk_ids):
+                counts = self._counts.setdefault(chunk_id, [0, 0])
+                counts[0 if rating > 0 else 1] += 1
+                self.scores[chunk_id] = self._score(*counts)
+                self._dirty.add(chunk_id)
+            due = len(self._dirty) >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            rows = [(chunk_id, *self._counts[chunk_id]) for chunk_id in self._dirty]
+            self._dirty.clear()
+            self._last_flush = time.monotonic()
+            if rows:
+                self._conn.executemany("INSERT OR REPLACE INTO chunk_feedback VALUES (?, ?, ?)", rows)
+                self._conn.commit()
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def get_feedback_index() -> FeedbackIndex:
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = FeedbackIndex()
+            atexit.register(_default_index.flush)
+        return _default_index
@@ -0,0 +1,210 @@
+import json
+import queue
+import threading
+from contextlib import closing
+
+import chunk_store
+import embedding_client
+import text_extraction
+import vector_db_querying as vdb
+
+
+# Bounded hand-off between stages; a full queue blocks the upstream stage (backpressure)
+QUEUE_DEPTH = 4
+# How often a blocked stage checks whether the consumer has gone away
+STOP_POLL_SECONDS = 0.1
+
+_DONE = object()
+
+
+# -------------------------------
+# Stage plumbing
+# -------------------------------
+
+def _put(out_queue, item, stop):
+    """Blocks until `item` is queued; returns False instead if `stop` is set first."""
+    while not stop.is_set():
+        try:
+            out_queue.put(item, timeout=STOP_POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _produce(iterable, out_queue, errors, stop):
+    try:
+        for item in iterable:
+            if not _put(out_queue, item, stop):
+                break
+    except BaseException as e:
+        errors.append(e)
+    finally:
+        # Close generators so upstream resources (e.g. the PDF extraction pool) are released
+        try:
+            if hasattr(iterable, "close"):
+                iterable.close()
+        except BaseException as e:
+            errors.append(e)
+        _put(out_queue, _DONE, stop)
+
+
+def run_stage(iterable, depth=QUEUE_DEPTH):
+    """
+    Drives `iterable` on a worker thread and hands its items over a bounded queue.
+    If the consumer stops early (an exception downstream, or close()), the worker is told to
+    stop, closes `iterable` and is joined, so no stage keeps running in the background.
+    """
+    out_queue = queue.Queue(maxsize=depth)
+    errors = []
+    stop = threading.Event()
+    worker = threading.Thread(target=_produce, args=(iterable, out_queue, errors, stop), daemon=True)
+    worker.start()
+    try:
+        while (item := out_queue.get()) is not _DONE:
+            yield item
+    finally:
+        stop.set()
+        worker.join()
+    if errors:
+        raise errors[0]
+
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# -------------------------------
+# Pipeline stages
+# -------------------------------
+
+def chunk_stage(sources, batch_size):
+    """extract -> clean -> chunk -> id, yielded in batches."""
+    for file_path in sources:
+        seen = {}
+        for batch in batched(text_extraction.iter_source_chunks(file_path), batch_size):
+            yield text_extraction.assign_chunk_ids(batch, seen)
+
+
+def embed_stage(chunk_batches, stored):
+    """Attaches embeddings, reusing rows of the previous store and embedding the rest in one batched call."""
+    client = embedding_client.get_client()
+    for batch in chunk_batches:
+        missing = []
+        for chunk in batch:
+            row = stored.row_for_hash(chunk["chunk_hash"]) if stored else None
+            if row is None:
+                missing.append(chunk)
+            else:
+                chunk["embedding"] = stored.embedding(row)
+        for chunk, embedding in zip(missing, client.embed([chunk["text"] for chunk in missing])):
+            chunk["embedding"] = embedding
+        yield batch, len(missing)
+
+
+# -------------------------------
+# Entry point
+# -------------------------------
+
+def run_ingestion(force=False, sources=None):
+    """
+    Streaming, incremental ingestion.
+    Unchanged sources (per the manifest) are carried over untouched. Changed or new sources
+    flow through extract -> clean -> chunk -> embed -> index as bounded, concurrently running
+    stages, and each batch is written to Chroma, the keyword index and the chunk store as
+    soon as it is embedded, so peak memory does not grow with the corpus.
+    Returns the new manifest.
+    """
+    sources = sources or text_extraction.PDF_FILES + text_extraction.HTML_FILES
+    fingerprints = {path: text_extraction.source_fingerprint(path) for path in sources}
+    manifest = text_extraction.load_manifest()
+
+    same_model = manifest.get("embed_model") == embedding_client.EMBED_MODEL
+    same_settings = same_model and manifest.get("chunker_version") == text_extraction.CHUNKER_VERSION
+    previous = manifest.get("sources", {}) if same_settings else {}
+    chunks_path = text_extraction.RAG_CHUNKS_PATH
+    stored = chunk_store.ChunkStore.open(chunks_path)
+    unchanged = {
+        path for path in sources
+        if not force and stored is not None and previous.get(path, {}).get("fingerprint") == fingerprints[path]
+    }
+
+    if len(unchanged) == len(sources) and set(previous) == set(sources):
+        print(f"Ingestion up to date: {manifest.get('chunk_count', 0)} chunks, nothing to re-embed.")
+        return manifest
+
+    changed = [path for path in sources if path not in unchanged]
+    collection = vdb.get_collection()
+    keyword_index = vdb.get_keyword_index()
+    client = embedding_client.get_client()
+    # Embeddings depend only on the model and chunk text, so they survive chunker changes
+    cache = stored if same_model else None
+
+    chunk_ids = {path: [] for path in sources}
+    embedded = 0
+    with chunk_store.ChunkStoreWriter(chunks_path) as out:
+        # Carry over unchanged sources row by row
+        if stored is not None:
+            for row in range(len(stored)):
+                if stored.document(row)["source"] in unchanged:
+                    chunk = stored.record(row)
+                    out.append([chunk])
+                    chunk_ids[chunk["source"]].append(chunk["id"])
+
+        # Stream changed sources through the pipeline
+        batch_size = client.batch_size * client.max_in_flight
+        # closing() stops and joins the stage threads even if a batch fails below (embed first, then chunk)
+        with closing(run_stage(chunk_stage(changed, batch_size))) as chunk_batches, \
+                closing(run_stage(embed_stage(chunk_batches, cache))) as embedded_batches:
+            for batch, n_embedded in embedded_batches:
+                out.append(batch)
+                for chunk in batch:
+                    chunk["embedding"] = [float(x) for x in chunk["embedding"]]
+                vdb.upsert_chunks(collection, batch)
+                keyword_index.add_documents([c["id"] for c in batch], [c["text"] for c in batch], [vdb.chunk_metadata(c) for c in batch])
+                for chunk in batch:
+                    chunk_ids[chunk["source"]].append(chunk["id"])
+                embedded += n_embedded
+
+        # Release the old store's memory maps (ours and the loaded numpy index's) before the writer swaps the directory
+        if stored is not None:
+            stored.close()
+        vdb.invalidate_numpy_index()
+
+    # Drop chunks that no longer exist in any source
+    current = {chunk_id for ids in chunk_ids.values() for chunk_id in ids}
+    stale = [
+        chunk_id
+        for entry in manifest.get("sources", {}).values()
+        for chunk_id in entry.get("chunk_ids", [])
+        if chunk_id not in current
+    ]
+    for batch in batched(stale, vdb.UPSERT_BATCH_SIZE):
+        collection.delete(ids=batch)
+    keyword_index.remove_documents(stale)
+    keyword_index.save(vdb.KEYWORD_INDEX_PATH)
+    vdb.invalidate_numpy_index()
+
+    new_manifest = {
+        "embed_model": embedding_client.EMBED_MODEL,
+        "chunker_version": text_extraction.CHUNKER_VERSION,
+        "chunk_count": len(current),
+        "sources": {
+            path: {"fingerprint": fingerprints[path], "chunk_ids": chunk_ids[path]}
+            for path in sources
+        },
+    }
+    new_manifest["corpus_version"] = text_extraction.corpus_version(new_manifest)
+    with open(text_extraction.MANIFEST_PATH, "w", encoding="utf-8") as f:
+        json.dump(new_manifest, f, indent=2)
+
+    print(f"Completed ingestion: {len(current)} chunks ready for RAG pipeline "
+          f"({len(changed)} sources re-ingested, {embedded} chunks embedded)!")
+    return new_manifest
@@ -0,0 +1,235 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+
+from retrieval_filters import metadata_tags
+
+
+TOKEN_PATTERN = re.compile(r"\w+")
+FORMAT_VERSION = 2
+
+# Metadata fields with their own value -> positions postings, used for prefiltering
+FILTER_FIELDS = ("jurisdiction", "law_type", "effective_date", "tags")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def scale_to_best(hits):
+    """
+    Divides (chunk id, bm25 score) hits by the best score. BM25 scores from indexes with
+    different IDF statistics are not comparable; scaled this way they can be merged.
+    """
+    if not hits or hits[0][1] <= 0:
+        return list(hits)
+    best = hits[0][1]
+    return [(chunk_id, score / best) for chunk_id, score in hits]
+
+
+class KeywordIndex:
+    """
+    Persistent BM25 (Okapi) inverted index keyed by chunk id.
+    Postings map term -> {doc position: term frequency}, so a query only touches
+    the postings of its own terms instead of scoring the whole corpus. Per-field postings
+    (jurisdiction, law type, effective date, tag -> positions) let a RetrievalFilter
+    narrow the candidates before any scoring.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids = []     # position -> chunk id (None once removed)
+        self.doc_lens = []    # position -> token count
+        self.positions = {}   # chunk id -> position
+        self.postings = {}    # term -> {position: tf}
+        self.field_postings = {field: {} for field in FILTER_FIELDS}   # field -> value -> {positions}
+        self.total_len = 0
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, chunk_id):
+        return chunk_id in self.positions
+
+    # ---------- updates ----------
+    def _field_values(self, metadata):
+        return {
+            "jurisdiction": [metadata.get("jurisdiction")],
+            "law_type": [metadata.get("law_type")],
+            "effective_date": [metadata.get("effective_date")],
+            "tags": metadata_tags(metadata),
+        }
+
+    def add_documents(self, ids, texts, metadatas=None):
+        metadatas = metadatas if metadatas is not None else [{}] * len(ids)
+        for chunk_id, text, metadata in zip(ids, texts, metadatas):
+            if chunk_id in self.positions:
+                continue
+            tokens = tokenize(text)
+            position = len(self.doc_ids)
+            self.doc_ids.append(chunk_id)
+            self.doc_lens.append(len(tokens))
+            self.positions[chunk_id] = position
+            self.total_len += len(tokens)
+            for term, tf in Counter(tokens).items():
+                self.postings.setdefault(term, {})[position] = tf
+            for field, values in self._field_values(metadata or {}).items():
+                for value in values:
+                    if value:
+                        self.field_postings[field].setdefault(value, set()).add(position)
+
+    def remove_documents(self, ids):
+        removed = {self.positions.pop(chunk_id) for chunk_id in ids if chunk_id in self.positions}
+        if not removed:
+            return
+        for position in removed:
+            self.total_len -= self.doc_lens[position]
+            self.doc_ids[position] = None
+            self.doc_lens[position] = 0
+        for term in list(self.postings):
+            docs = self.postings[term]
+            for position in removed.intersection(docs):
+                del docs[position]
+            if not docs:
+                del self.postings[term]
+        for values in self.field_postings.values():
+            for value in list(values):
+                values[value] -= removed
+                if not values[value]:
+                    del values[value]
+
+    def sync(self, ids, texts, metadatas=None):
+        """Adds missing ids and drops ids no longer present. Returns True if anything changed."""
+        metadatas = metadatas if metadatas is not None else [{}] * len(ids)
+        wanted = set(ids)
+        stale = [chunk_id for chunk_id in self.positions if chunk_id not in wanted]
+        missing = [
+            (chunk_id, text, metadata)
+            for chunk_id, text, metadata in zip(ids, texts, metadatas)
+            if chunk_id not in self.positions
+        ]
+        self.remove_documents(stale)
+        if missing:
+            self.add_documents(*map(list, zip(*missing)))
+        return bool(stale or missing)
+
+    # ---------- filtering ----------
+    def _union(self, field, values):
+        postings = self.field_postings[field]
+        return set().union(*(postings.get(value, ()) for value in values))
+
+    def allowed_positions(self, filters):
+        """Positions passing the filter, or None when the filter is empty."""
+        if not filters:
+            return None
+        sets = []
+        if filters.jurisdictions:
+            sets.append(self._union("jurisdiction", filters.jurisdictions))
+        if filters.law_types:
+            sets.append(self._union("law_type", filters.law_types))
+        if filters.in_force_on:
+            dates = [d for d in self.field_postings["effective_date"] if d <= filters.in_force_on]
+            sets.append(self._union("effective_date", dates))
+        if filters.tags:
+            sets.append(self._union("tags", filters.tags))
+        return set.intersection(*sets)
+
+    # ---------- scoring ----------
+    def idf(self, term):
+        n_docs = len(self.positions)
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+
+    def score(self, query, filters=None):
+        """
+        Returns {chunk_id: bm25 score} for every chunk containing at least one query term,
+        restricted to chunks passing `filters` (a RetrievalFilter) when given.
+        """
+        if not self.positions:
+            return {}
+        return self._score(query, self.allowed_positions(filters), {})
+
+    def _score(self, query, allowed, idfs):
+        """BM25 over the query terms' postings; `idfs` caches term idfs across the queries of a batch."""
+        if allowed is not None and not allowed:
+            return {}
+        avgdl = self.total_len / len(self.positions) or 1.0
+        scores = {}
+        for term, qtf in Counter(tokenize(query)).items():
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = idfs.get(term)
+            if idf is None:
+                idf = idfs[term] = self.idf(term)
+            for position, tf in docs.items():
+                if allowed is not None and position not in allowed:
+                    continue
+                norm = tf + self.k1 * (1 - self.b + self.b * self.doc_lens[position] / avgdl)
+                scores[position] = scores.get(position, 0.0) + qtf * idf * tf * (self.k1 + 1) / norm
+        return {self.doc_ids[position]: s for position, s in scores.items()}
+
+    def top_n(self, query, n, filters=None):
+        scores = self.score(query, filters)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n]
+
+    def top_n_batch(self, queries, n, filters=None):
+        """top_n for several queries; the filter and each term's idf are evaluated once for the whole batch."""
+        if not self.positions:
+            return [[] for _ in queries]
+        allowed = self.allowed_positions(filters)
+        idfs = {}
+        return [
+            sorted(self._score(query, allowed, idfs).items(), key=lambda item: item[1], reverse=True)[:n]
+            for query in queries
+        ]
+
+    # ---------- persistence ----------
+    def save(self, path):
+        live = [(chunk_id, self.doc_lens[pos]) for chunk_id, pos in sorted(self.positions.items(), key=lambda x: x[1])]
+        remap = {self.positions[chunk_id]: new_pos for new_pos, (chunk_id, _) in enumerate(live)}
+        data = {
+            "version": FORMAT_VERSION,
+            "k1": self.k1,
+            "b": self.b,
+            "doc_ids": [chunk_id for chunk_id, _ in live],
+            "doc_lens": [length for _, length in live],
+            "postings": {
+                term: [[remap[pos], tf] for pos, tf in docs.items()]
+                for term, docs in self.postings.items()
+            },
+            "field_postings": {
+                field: {value: sorted(remap[pos] for pos in positions) for value, positions in values.items()}
+                for field, values in self.field_postings.items()
+            },
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Loads a saved index, or returns an empty one if none exists yet (or it is an older format)."""
+        index = cls()
+        if not os.path.exists(path):
+            return index
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != FORMAT_VERSION:
+            return index
+        index.k1 = data["k1"]
+        index.b = data["b"]
+        index.doc_ids = data["doc_ids"]
+        index.doc_lens = data["doc_lens"]
+        index.positions = {chunk_id: pos for pos, chunk_id in enumerate(index.doc_ids)}
+        index.total_len = sum(index.doc_lens)
+        index.postings = {term: {pos: tf for pos, tf in docs} for term, docs in data["postings"].items()}
+        index.field_postings = {
+            field: {value: set(positions) for value, positions in data["field_postings"].get(field, {}).items()}
+            for field in FILTER_FIELDS
+        }
+        return index
@@ -0,0 +1,167 @@
+"""
+Process-wide scheduler in front of LLM generation.
+
+- Bounded concurrency: at most `max_concurrency` generations run against Ollama at once.
+- Fair queueing: waiting requests are queued per session and served round-robin, so one
+  session (or a batch run) submitting many requests cannot starve the others.
+- Singleflight: a request whose body is identical to one already queued or running joins
+  that generation and receives the same token stream instead of starting another.
+"""
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "2"))
+DEFAULT_SESSION = "default"
+
+_current_session = contextvars.ContextVar("llm_session", default=DEFAULT_SESSION)
+
+
+@contextmanager
+def session_scope(session_id):
+    """Attributes generations started inside the block to `session_id` for fair queueing."""
+    token = _current_session.set(session_id)
+    try:
+        yield
+    finally:
+        _current_session.reset(token)
+
+
+class Flight:
+    """One generation and its token stream, shared by every caller that asked for the same body."""
+
+    def __init__(self, key, body):
+        self.key = key
+        self.body = body
+        self.tokens = []
+        self.stats = {}
+        self.error = None
+        self.done = False
+        self.enqueued = time.perf_counter()
+        self.started = None
+        self._cond = threading.Condition()
+
+    def push(self, token):
+        with self._cond:
+            self.tokens.append(token)
+            self._cond.notify_all()
+
+    def finish(self, stats=None, error=None):
+        with self._cond:
+            self.stats = stats or {}
+            self.error = error
+            self.done = True
+            self._cond.notify_all()
+
+    def __iter__(self):
+        """Yields every token from the start, blocking until more arrive or the generation ends."""
+        i = 0
+        while True:
+            with self._cond:
+                while i >= len(self.tokens) and not self.done:
+                    self._cond.wait()
+                new = self.tokens[i:]
+                finished = self.done
+            yield from new
+            i += len(new)
+            if finished:
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class LLMScheduler:
+    """
+    `generate(body, on_token)` performs one generation, calling on_token for each token,
+    and returns a stats dict; it runs on the scheduler's worker threads.
+    """
+
+    def __init__(self, generate, max_concurrency=LLM_MAX_CONCURRENCY):
+        self._generate = generate
+        self.max_concurrency = max_concurrency
+        self._lock = threading.Lock()
+        self._work = threading.Condition(self._lock)
+        self._queues = OrderedDict()   # session -> deque of waiting flights, in round-robin order
+        self._in_flight = {}           # body hash -> Flight (queued or running)
+        self._workers = []
+
+    @staticmethod
+    def request_key(body):
+        return hashlib.sha256(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def submit(self, body, session=None):
+        """Returns (flight, joined) where joined is True if an identical request was already in flight."""
+        key = self.request_key(body)
+        session = session or _current_session.get()
+        with self._lock:
+            flight = self._in_flight.get(key)
+            if flight is not None:
+                return flight, True
+            flight = self._in_flight[key] = Flight(key, body)
+            self._queues.setdefault(session, deque()).append(flight)
+            self._ensure_workers()
+            self._work.notify()
+            return flight, False
+
+    def stream(self, body, session=None):
+        flight, _ = self.submit(body, session)
+        yield from flight
+
+    def raise_concurrency(self, max_concurrency):
+        """Allows at least `max_concurrency` generations at once (never lowers the limit)."""
+        with self._lock:
+            self.max_concurrency = max(self.max_concurrency, max_concurrency)
+            self._ensure_workers()
+
+    def queue_depth(self):
+        with self._lock:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def _ensure_workers(self):
+        while len(self._workers) < self.max_concurrency:
+            worker = threading.Thread(target=self._run, name=f"llm-{len(self._workers)}", daemon=True)
+            self._workers.append(worker)
+            worker.start()
+
+    def _next_flight(self):
+        with self._lock:
+            while not self._queues:
+                self._work.wait()
+            session, queue = next(iter(self._queues.items()))
+            flight = queue.popleft()
+            if queue:
+                self._queues.move_to_end(session)   # next session gets the following slot
+            else:
+                del self._queues[session]
+            return flight
+
+    def _run(self):
+        flight = None
+        try:
+            while True:
+                flight = self._next_flight()
+                flight.started = time.perf_counter()
+                stats, error = None, None
+                try:
+                    stats = self._generate(flight.body, flight.push)
+                except Exception as e:
+                    error = e
+                with self._lock:
+                    self._in_flight.pop(flight.key, None)
+                flight.finish(stats, error)
+                flight = None
+        finally:
+            # Only reached if this worker dies (a BaseException): fail its flight and let a new worker take its slot
+            with self._lock:
+                self._workers.remove(threading.current_thread())
+                if flight is not None:
+                    self._in_flight.pop(flight.key, None)
+                if self._queues:
+                    self._ensure_workers()
+            if flight is not None and not flight.done:
+                flight.finish(error=RuntimeError("LLM scheduler worker stopped"))
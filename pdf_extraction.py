@@ -0,0 +1,69 @@
+import io
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from pypdf import PdfReader
+
+
+# Below this many pages the process pool costs more than it saves
+PARALLEL_MIN_PAGES = 40
+PAGES_PER_TASK = 16
+
+
+def _open(source):
+    return PdfReader(source if isinstance(source, (str, os.PathLike)) else io.BytesIO(source))
+
+
+# The document each pool worker extracts from, opened once by _init_worker
+_worker_reader = None
+
+
+def _init_worker(source):
+    global _worker_reader
+    _worker_reader = _open(source)
+
+
+def _extract_range(start, stop):
+    """Worker: (page number, text) for pages [start, stop), 1-based page numbers."""
+    return [(n + 1, _worker_reader.pages[n].extract_text() or "") for n in range(start, stop)]
+
+
+def iter_pdf_pages(source, max_workers=None, pages_per_task=PAGES_PER_TASK, parallel_min_pages=PARALLEL_MIN_PAGES):
+    """
+    Yields (page number, text) for each page, in order.
+    `source` is a file path or a file-like object (e.g. a Streamlit upload).
+    Large documents are split into page ranges extracted across a process pool; at most
+    two ranges per worker are in flight, so memory stays bounded however long the PDF is.
+    Each worker receives the document once (a path, or the bytes of an upload) and tasks
+    carry only page ranges. Workers are spawned, not forked: the app extracts while other
+    threads are running, and forking a multithreaded process can deadlock.
+    """
+    if not isinstance(source, (str, os.PathLike)):
+        source = source.getvalue() if hasattr(source, "getvalue") else source.read()
+
+    reader = _open(source)
+    page_count = len(reader.pages)
+    workers = max_workers or os.cpu_count() or 1
+
+    if page_count < parallel_min_pages or workers <= 1:
+        for n, page in enumerate(reader.pages):
+            yield n + 1, page.extract_text() or ""
+        return
+    del reader
+
+    ranges = deque((start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task))
+    workers = min(workers, len(ranges))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(source,)) as pool:
+        in_flight = deque()
+        while ranges or in_flight:
+            while ranges and len(in_flight) < workers * 2:
+                in_flight.append(pool.submit(_extract_range, *ranges.popleft()))
+            yield from in_flight.popleft().result()
+
+
+def extract_pdf_text(source, **kwargs) -> str:
+    """Whole-document text, pages separated by blank lines."""
+    return "".join(text + "\n\n" for _, text in iter_pdf_pages(source, **kwargs))
@@ -0,0 +1,177 @@
+import hashlib
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+
+class RerankerService:
+    """
+    Process-wide cross-encoder reranker.
+    The model is loaded on first use, (query, chunk id) scores are kept in an LRU cache,
+    and when `coalesce_window` is set, pairs submitted by concurrent callers within that
+    window (measured from the first waiting request, up to `max_coalesced_pairs` pairs) are
+    scored together in one batched forward pass.
+    """
+
+    def __init__(self, model_name=RERANK_MODEL, batch_size=32, max_length=512, cache_size=4096, coalesce_window=0.005,
+                 max_coalesced_pairs=256):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.cache_size = cache_size
+        self.coalesce_window = coalesce_window
+        self.max_coalesced_pairs = max_coalesced_pairs
+
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._pending = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    # ---------- model ----------
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_name, max_length=self.max_length)
+        return self._model
+
+    def _predict(self, pairs):
+        return [float(s) for s in self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)]
+
+    # ---------- request coalescing ----------
+    def _ensure_worker(self):
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="reranker", daemon=True)
+                self._worker.start()
+
+    def _next_requests(self):
+        """The first waiting request plus any that arrive before its deadline, up to max_coalesced_pairs."""
+        requests = [self._pending.get()]
+        n_pairs = len(requests[0][0])
+        deadline = time.monotonic() + self.coalesce_window
+        while n_pairs < self.max_coalesced_pairs:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                requests.append(self._pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+            n_pairs += len(requests[-1][0])
+        return requests
+
+    def _run(self):
+        requests = []
+        try:
+            while True:
+                requests = self._next_requests()
+                pairs = [pair for request_pairs, _ in requests for pair in request_pairs]
+                try:
+                    scores = self._predict(pairs)
+                except Exception as e:
+                    for _, future in requests:
+                        future.set_exception(e)
+                    continue
+                offset = 0
+                for request_pairs, future in requests:
+                    future.set_result(scores[offset : offset + len(request_pairs)])
+                    offset += len(request_pairs)
+        finally:
+            # Only reached if the worker dies (e.g. on a BaseException): fail its own and any queued
+            # requests instead of leaving their callers waiting; the next request starts a new worker
+            with self._worker_lock:
+                self._worker = None
+            error = RuntimeError("Reranker worker stopped")
+            while True:
+                try:
+                    requests.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            for _, future in requests:
+                if not future.done():
+                    future.set_exception(error)
+
+    def _score_pairs(self, pairs):
+        if not self.coalesce_window:
+            return self._predict(pairs)
+        future = Future()
+        # Queue before ensuring the worker, so a dying worker either fails this request or a new one serves it
+        self._pending.put((pairs, future))
+        self._ensure_worker()
+        return future.result()
+
+    # ---------- public API ----------
+    def score(self, query, chunks, chunk_ids=None):
+        """Cross-encoder scores for each chunk, reusing cached (query, chunk id) scores."""
+        return self.score_batch([query], [chunks], None if chunk_ids is None else [chunk_ids])[0]
+
+    def score_batch(self, queries, chunk_lists, chunk_id_lists=None):
+        """
+        score() for several queries at once: every uncached (query, chunk) pair across the
+        batch goes through a single batched forward pass. Returns one score list per query.
+        """
+        if chunk_id_lists is None:
+            chunk_id_lists = [None] * len(queries)
+        keys, texts = [], {}
+        for query, chunks, chunk_ids in zip(queries, chunk_lists, chunk_id_lists):
+            if chunk_ids is None:
+                chunk_ids = [hashlib.sha256(chunk.encode("utf-8")).hexdigest() for chunk in chunks]
+            query_keys = [(query, chunk_id) for chunk_id in chunk_ids]
+            keys.append(query_keys)
+            texts.update(zip(query_keys, chunks))
+
+        scores = {}
+        with self._cache_lock:
+            for key in texts:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[key] = self._cache[key]
+
+        missing = [key for key in texts if key not in scores]   # duplicates collapse in the dict
+        if missing:
+            fresh = self._score_pairs([(query, texts[(query, chunk_id)]) for query, chunk_id in missing])
+            with self._cache_lock:
+                for key, value in zip(missing, fresh):
+                    scores[key] = value
+                    self._cache[key] = value
+                    self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        return [[scores[key] for key in query_keys] for query_keys in keys]
+
+    def rerank(self, query, chunks, chunk_ids=None):
+        """Chunks sorted by cross-encoder score, best first."""
+        return self.rerank_batch([query], [chunks], None if chunk_ids is None else [chunk_ids])[0]
+
+    def rerank_batch(self, queries, chunk_lists, chunk_id_lists=None):
+        """rerank() for several queries, scored in one batched forward pass."""
+        results = []
+        for chunks, scores in zip(chunk_lists, self.score_batch(queries, chunk_lists, chunk_id_lists)):
+            order = sorted(range(len(chunks)), key=lambda i: scores[i], reverse=True)
+            results.append([chunks[i] for i in order])
+        return results
+
+
+_default_reranker = None
+_default_reranker_lock = threading.Lock()
+
+
+def get_reranker() -> RerankerService:
+    """Shared reranker for every caller (and every Streamlit session) in this process."""
+    global _default_reranker
+    with _default_reranker_lock:
+        if _default_reranker is None:
+            _default_reranker = RerankerService()
+        return _default_reranker
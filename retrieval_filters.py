@@ -0,0 +1,62 @@
+TAG_PREFIX = "tag:"
+
+
+def effective_ts(date):
+    """"2024-09-20" -> 20240920, the numeric form Chroma can range-compare."""
+    return int(date.replace("-", "")) if date else None
+
+
+def metadata_tags(metadata):
+    """Tags from either a chunk record (list) or Chroma metadata (comma-joined string)."""
+    tags = metadata.get("tags") or []
+    if isinstance(tags, str):
+        tags = [tag.strip() for tag in tags.split(",")]
+    return [tag for tag in tags if tag]
+
+
+class RetrievalFilter:
+    """
+    Metadata prefilter applied inside every retriever, before scoring.
+    Each given criterion must hold; within a criterion any listed value matches, e.g.
+    RetrievalFilter(jurisdictions=["US-CA", "US-FL"], law_types=["ChildProtection"], in_force_on="2025-06-01").
+    """
+
+    def __init__(self, jurisdictions=None, law_types=None, in_force_on=None, tags=None):
+        self.jurisdictions = list(jurisdictions) if jurisdictions else None
+        self.law_types = list(law_types) if law_types else None
+        self.in_force_on = in_force_on
+        self.tags = list(tags) if tags else None
+
+    def __bool__(self):
+        return bool(self.jurisdictions or self.law_types or self.in_force_on or self.tags)
+
+    def __repr__(self):
+        return (f"RetrievalFilter(jurisdictions={self.jurisdictions}, law_types={self.law_types}, "
+                f"in_force_on={self.in_force_on!r}, tags={self.tags})")
+
+    def matches(self, metadata):
+        if self.jurisdictions and metadata.get("jurisdiction") not in self.jurisdictions:
+            return False
+        if self.law_types and metadata.get("law_type") not in self.law_types:
+            return False
+        if self.in_force_on and not (metadata.get("effective_date") and metadata["effective_date"] <= self.in_force_on):
+            return False
+        if self.tags and not set(self.tags).intersection(metadata_tags(metadata)):
+            return False
+        return True
+
+    def chroma_where(self):
+        """Equivalent Chroma `where` clause, or None when there is nothing to filter on."""
+        clauses = []
+        if self.jurisdictions:
+            clauses.append({"jurisdiction": {"$in": self.jurisdictions}})
+        if self.law_types:
+            clauses.append({"law_type": {"$in": self.law_types}})
+        if self.in_force_on:
+            clauses.append({"effective_ts": {"$lte": effective_ts(self.in_force_on)}})
+        if self.tags:
+            tag_clauses = [{TAG_PREFIX + tag: True} for tag in self.tags]
+            clauses.append(tag_clauses[0] if len(tag_clauses) == 1 else {"$or": tag_clauses})
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
@@ -0,0 +1,134 @@
+"""Per-session retrieval layer over user-uploaded policy documents."""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import embedding_client
+import text_extraction
+from keyword_index import KeywordIndex, scale_to_best
+from vector_index import NumpyVectorIndex
+
+
+class PolicyLayer:
+    """Chunks, embeddings and keyword postings of one uploaded policy, keyed by content hash."""
+
+    def __init__(self, content_hash, name, chunks, embeddings):
+        self.content_hash = content_hash
+        self.name = name
+        self.ids = [f"policy:{content_hash[:16]}:{i}" for i in range(len(chunks))]
+        self.texts = dict(zip(self.ids, chunks))
+        # A policy without extractable text (e.g. a scanned PDF) yields an empty layer
+        matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(chunks), -1) if chunks else np.zeros((0, 0), np.float32)
+        self.vectors = NumpyVectorIndex(matrix, self.ids)
+        self.keywords = KeywordIndex()
+        self.keywords.add_documents(self.ids, chunks)
+
+    @classmethod
+    def build(cls, content_hash, name, text):
+        chunks = [chunk for chunk, _, _ in text_extraction.chunk_pages([(1, text)])]
+        embeddings = embedding_client.get_client().embed(chunks) if chunks else []
+        return cls(content_hash, name, chunks, embeddings)
+
+
+class SessionLayer:
+    """The policy layers one session has uploaded, searched together."""
+
+    def __init__(self):
+        self.policies = OrderedDict()   # content hash -> PolicyLayer
+        self.last_used = time.monotonic()
+
+    def __bool__(self):
+        return any(layer.ids for layer in self.policies.values())
+
+    def vector_hits(self, query_embedding, n):
+        """(chunk id, cosine distance) across all policies, closest first."""
+        hits = [hit for layer in self.policies.values() for hit in layer.vectors.query(query_embedding, n)[0]]
+        return sorted(hits, key=lambda hit: hit[1])[:n]
+
+    def keyword_hits(self, query, n):
+        """(chunk id, BM25 score scaled to each policy's best hit), best first; every policy has its own IDF."""
+        hits = [hit for layer in self.policies.values() for hit in scale_to_best(layer.keywords.top_n(query, n))]
+        return sorted(hits, key=lambda hit: hit[1], reverse=True)[:n]
+
+    def text(self, chunk_id):
+        for layer in self.policies.values():
+            if chunk_id in layer.texts:
+                return layer.texts[chunk_id]
+        return None
+
+
+class SessionRegistry:
+    """
+    Process-wide registry of session layers.
+    Policy layers are deduplicated by content hash across sessions, so re-uploading a policy
+    (in any session) costs nothing. Streamlit has no session-end hook, so sessions idle for
+    longer than `idle_ttl` seconds, and the least recently used sessions beyond `max_sessions`,
+    are evicted. Policy layers no
+    session references are dropped once more than `max_policies` are held.
+    """
+
+    def __init__(self, max_sessions=64, idle_ttl=3600, max_policies=128):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_policies = max_policies
+        self._sessions = OrderedDict()   # session id -> SessionLayer
+        self._policies = OrderedDict()   # content hash -> PolicyLayer
+        self._lock = threading.Lock()
+
+    def _sweep(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        for session_id in [sid for sid, layer in self._sessions.items() if layer.last_used < cutoff]:
+            del self._sessions[session_id]
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+        referenced = {h for layer in self._sessions.values() for h in layer.policies}
+        for content_hash in list(self._policies):
+            if len(self._policies) <= self.max_policies:
+                break
+            if content_hash not in referenced:
+                del self._policies[content_hash]
+
+    def get(self, session_id):
+        with self._lock:
+            layer = self._sessions.pop(session_id, None)
+            if layer is None:
+                layer = SessionLayer()
+            layer.last_used = time.monotonic()
+            self._sessions[session_id] = layer
+            self._sweep()
+            return layer
+
+    def add_policy(self, session_id, name, text):
+        """Indexes a policy for the session. Returns False if this exact content was already indexed there."""
+        content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        session = self.get(session_id)
+        if content_hash in session.policies:
+            return False
+
+        with self._lock:
+            policy = self._policies.get(content_hash)
+        if policy is None:
+            policy = PolicyLayer.build(content_hash, name, text)
+
+        with self._lock:
+            self._policies[content_hash] = policy
+            self._policies.move_to_end(content_hash)
+            session.policies[content_hash] = policy
+            self._sweep()
+        return True
+
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+
+def get_session_registry() -> SessionRegistry:
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = SessionRegistry()
+        return _default_registry
@@ -0,0 +1,116 @@
+"""
+Compiled terminology expansion.
+
+The glossary is compiled once into a single regex shaped like a trie of its terms
+(`\b(?:G(?:DPR|H)|...)\b`), so every occurrence of every term is expanded in one pass
+over the text and the cost per character stays flat as the glossary grows. Longer terms
+win over their prefixes. Glossary files are re-read when they change on disk.
+
+Tenants can add or override terms with data_sources/terminology/<tenant>.json, which is
+layered over the shared glossary.
+"""
+import json
+import os
+import re
+import threading
+import time
+
+GLOSSARY_PATH = "data_sources/terminology.json"
+TENANT_GLOSSARY_DIR = "data_sources/terminology"
+
+
+def _trie_pattern(terms):
+    trie = {}
+    for term in terms:
+        node = trie
+        for ch in term:
+            node = node.setdefault(ch, {})
+        node[""] = {}   # end of a term
+
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            # A term ends here but longer ones continue; the greedy ? tries the longer ones first
+            return ("(?:" + body + ")" if len(branches) == 1 and len(body) > 1 else body) + "?"
+        return body
+
+    return build(trie)
+
+
+class TerminologyEngine:
+    """Expands every glossary term in `text` to "TERM (definition)" in a single pass."""
+
+    def __init__(self, glossary):
+        self.glossary = dict(glossary)
+        terms = [term for term in self.glossary if term]
+        self.pattern = re.compile(r"\b(?:" + _trie_pattern(terms) + r")\b") if terms else None
+
+    def expand(self, text):
+        if self.pattern is None:
+            return text
+        return self.pattern.sub(lambda m: f"{m.group(0)} ({self.glossary[m.group(0)]})", text)
+
+
+def _read_glossary(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class TerminologyStore:
+    """
+    One compiled engine per tenant, rebuilt when its glossary files change.
+    File modification times are checked at most every `check_interval` seconds.
+    """
+
+    def __init__(self, path=GLOSSARY_PATH, tenant_dir=TENANT_GLOSSARY_DIR, check_interval=1.0):
+        self.path = path
+        self.tenant_dir = tenant_dir
+        self.check_interval = check_interval
+        self._engines = {}   # tenant -> (file mtimes, last check, engine)
+        self._lock = threading.Lock()
+
+    def _paths(self, tenant):
+        paths = [self.path]
+        if tenant:
+            tenant_path = os.path.join(self.tenant_dir, f"{tenant}.json")
+            if os.path.exists(tenant_path):
+                paths.append(tenant_path)
+        return paths
+
+    def get(self, tenant=None):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._engines.get(tenant)
+            if cached is not None and now - cached[1] < self.check_interval:
+                return cached[2]
+            paths = self._paths(tenant)
+            mtimes = tuple((p, os.path.getmtime(p)) for p in paths)
+            if cached is not None and cached[0] == mtimes:
+                self._engines[tenant] = (mtimes, now, cached[2])
+                return cached[2]
+
+            glossary = {}
+            for p in paths:
+                glossary.update(_read_glossary(p))   # tenant terms override shared ones
+            engine = TerminologyEngine(glossary)
+            self._engines[tenant] = (mtimes, now, engine)
+            return engine
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_terminology_store() -> TerminologyStore:
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = TerminologyStore()
+        return _default_store
+
+
+def expand(text, tenant=None):
+    return get_terminology_store().get(tenant).expand(text)
@@ -1,27 +1,30 @@
 import os
-from PyPDF2 import PdfReader
-from bs4 import BeautifulSoup
-import requests
-from transformers import GPT2TokenizerFast
-from tokenizers import Tokenizer
-from tokenizers.models import BPE
 import re
 import json
+import hashlib
+import threading
+from functools import lru_cache
 
-import nltk
-from nltk.data import find
-from nltk.tokenize import sent_tokenize
+import chunk_store
+import embedding_client
+import pdf_extraction
 
-# Ensure NLTK looks in a stable, writable location (fixes punkt_tab lookup on some systems)
+# NLTK, tokenizers and BeautifulSoup are imported on first use, so importing this module
+# (from the app, workers or the batch runner) stays cheap when no ingestion runs.
 NLTK_DATA_DIR = os.path.expanduser("~/nltk_data")
-if NLTK_DATA_DIR not in nltk.data.path:
-    nltk.data.path.append(NLTK_DATA_DIR)
 
+@lru_cache(maxsize=None)
 def _ensure_punkt_models() -> None:
     """
     Make sure sentence models exist across NLTK versions.
-    Newer NLTK uses punkt_tab; older uses punkt. Safe to call repeatedly.
+    Newer NLTK uses punkt_tab; older uses punkt. Cached, so the lookup runs once per process.
     """
+    import nltk
+    from nltk.data import find
+
+    # Ensure NLTK looks in a stable, writable location (fixes punkt_tab lookup on some systems)
+    if NLTK_DATA_DIR not in nltk.data.path:
+        nltk.data.path.append(NLTK_DATA_DIR)
     # Try the newer punkt_tab first
     try:
         find("tokenizers/punkt_tab/english/")
@@ -144,28 +147,139 @@ def clean_text(text):
 # TOKENIZER for chunking
 # -------------------------------
 
-def chunk_text(text, max_tokens=400, overlap=100):
+# Hugging Face tokenizer matching the Ollama embedding model (mxbai-embed-large)
+EMBED_TOKENIZER = "mixedbread-ai/mxbai-embed-large-v1"
+# The model's context is 512 tokens including [CLS]/[SEP]
+MAX_CHUNK_TOKENS = 510
+CHUNK_OVERLAP_TOKENS = 64
+# A statute boundary only closes the current chunk once it holds at least this share of max_tokens
+MIN_SECTION_FILL = 0.25
+# Seconds to wait for the tokenizer when it is not cached locally yet
+TOKENIZER_LOAD_TIMEOUT = float(os.environ.get("TOKENIZER_LOAD_TIMEOUT", "10"))
+
+# Start of an Article / Section / § heading at the beginning of a line
+SECTION_BOUNDARY = re.compile(r"(?m)^[ \t]*(?=(?:Article|ARTICLE|Section|SECTION|Sec\.|SEC\.)\s+\d|§)")
+
+
+_tokenizer = None
+_tokenizer_error = None
+_tokenizer_lock = threading.Lock()
+
+
+def _load_tokenizer(result):
+    try:
+        from huggingface_hub import hf_hub_download
+        from tokenizers import Tokenizer
+        try:
+            path = hf_hub_download(EMBED_TOKENIZER, "tokenizer.json", local_files_only=True)
+        except Exception:
+            path = hf_hub_download(EMBED_TOKENIZER, "tokenizer.json", etag_timeout=TOKENIZER_LOAD_TIMEOUT)
+        result["tokenizer"] = Tokenizer.from_file(path)
+    except Exception as e:
+        result["error"] = e
+
+
+def _embedding_tokenizer():
+    """
+    Loaded once per process, from the local Hugging Face cache when possible.
+    There is deliberately no estimate to fall back on: it would give different chunk boundaries
+    and ids under the same CHUNKER_VERSION, and chunks that overflow the embedding model. If the
+    tokenizer cannot be loaded within TOKENIZER_LOAD_TIMEOUT seconds, this raises (now and on
+    every later call in the process).
+    """
+    global _tokenizer, _tokenizer_error
+    if _tokenizer is not None:
+        return _tokenizer
+    with _tokenizer_lock:
+        if _tokenizer is None and _tokenizer_error is None:
+            result = {}
+            loader = threading.Thread(target=_load_tokenizer, args=(result,), name="tokenizer-load", daemon=True)
+            loader.start()
+            loader.join(TOKENIZER_LOAD_TIMEOUT)
+            _tokenizer = result.get("tokenizer")
+            if _tokenizer is None:
+                _tokenizer_error = result.get("error") or TimeoutError(f"not loaded within {TOKENIZER_LOAD_TIMEOUT:g} s")
+        if _tokenizer_error is not None:
+            raise RuntimeError(
+                f"Could not load tokenizer {EMBED_TOKENIZER} ({_tokenizer_error}); it is required for chunking. "
+                f"Run once with network access to cache it, or point HF_HOME at a cache that has it."
+            ) from _tokenizer_error
+        return _tokenizer
+
+
+def count_tokens(text: str) -> int:
+    return len(_embedding_tokenizer().encode(text, add_special_tokens=False).ids)
+
+
+def _split_long_sentence(sentence: str, max_tokens: int):
+    """Splits a sentence longer than max_tokens into token windows."""
+    tokenizer = _embedding_tokenizer()
+    offsets = tokenizer.encode(sentence, add_special_tokens=False).offsets
+    return [
+        sentence[offsets[i][0] : offsets[min(i + max_tokens, len(offsets)) - 1][1]]
+        for i in range(0, len(offsets), max_tokens)
+    ]
+
+
+def _sentence_units(pages, max_tokens):
+    """(sentence, token count, page number, starts a new section) for every sentence."""
     _ensure_punkt_models()
-    sentences = sent_tokenize(text)
-    chunks, current_chunk = [], []
+    from nltk.tokenize import sent_tokenize
+    for page_number, text in pages:
+        for k, section in enumerate(SECTION_BOUNDARY.split(text)):
+            starts_section = k > 0 or bool(SECTION_BOUNDARY.match(section))
+            for sent in sent_tokenize(section):
+                sent = " ".join(sent.split())
+                if not sent:
+                    continue
+                n_tokens = count_tokens(sent)
+                pieces = [(sent, n_tokens)] if n_tokens <= max_tokens else [
+                    (piece, count_tokens(piece)) for piece in _split_long_sentence(sent, max_tokens)
+                ]
+                for piece, piece_tokens in pieces:
+                    yield piece, piece_tokens, page_number, starts_section
+                    starts_section = False
+
+
+def chunk_pages(pages, max_tokens=MAX_CHUNK_TOKENS, overlap=CHUNK_OVERLAP_TOKENS):
+    """
+    Streaming, token-accurate chunker over (page number, text) pairs.
+    Sentences are packed up to max_tokens of the embedding model's tokenizer, with about
+    `overlap` tokens of trailing sentences repeated into the next chunk. Article/Section/§
+    headings start a fresh chunk (without overlap) once the current one is reasonably full.
+    Yields (chunk, first page, last page) as soon as each chunk is complete.
+    """
+    current_chunk = []  # (sentence, tokens, page number)
     current_len = 0
 
-    for sent in sentences:
-        words = sent.split()
-        sent_len = len(words)
+    def emit():
+        return " ".join(s for s, _, _ in current_chunk), current_chunk[0][2], current_chunk[-1][2]
+
+    for sent, n_tokens, page_number, starts_section in _sentence_units(pages, max_tokens):
+        if current_chunk and starts_section and current_len >= max_tokens * MIN_SECTION_FILL:
+            yield emit()
+            current_chunk, current_len = [], 0
 
-        if current_len + sent_len > max_tokens:
-            chunks.append(" ".join(current_chunk))
-            current_chunk = current_chunk[-overlap:]  # add overlap
-            current_len = len(current_chunk)
+        elif current_chunk and current_len + n_tokens > max_tokens:
+            yield emit()
+            # add overlap: trailing sentences that fit in `overlap` tokens and leave room for this one
+            kept, kept_len = [], 0
+            for unit in reversed(current_chunk):
+                if kept_len + unit[1] > min(overlap, max_tokens - n_tokens):
+                    break
+                kept.insert(0, unit)
+                kept_len += unit[1]
+            current_chunk, current_len = kept, kept_len
 
-        current_chunk.extend(words)
-        current_len += sent_len
+        current_chunk.append((sent, n_tokens, page_number))
+        current_len += n_tokens
 
     if current_chunk:
-        chunks.append(" ".join(current_chunk))
+        yield emit()
+
 
-    return chunks
+def chunk_text(text, max_tokens=MAX_CHUNK_TOKENS, overlap=CHUNK_OVERLAP_TOKENS):
+    return [chunk for chunk, _, _ in chunk_pages([(1, clean_text(text))], max_tokens, overlap)]
 
 
 # -------------------------------
@@ -173,11 +287,7 @@ def chunk_text(text, max_tokens=400, overlap=100):
 # -------------------------------
 def extract_text_from_pdf(file_path: str) -> str:
     """Extracts text from a PDF file."""
-    text = ""
-    reader = PdfReader(file_path)
-    for page in reader.pages:
-        text += page.extract_text() + "\n\n"
-    return text
+    return pdf_extraction.extract_pdf_text(file_path)
 
 
 # -------------------------------
@@ -185,6 +295,7 @@ def extract_text_from_pdf(file_path: str) -> str:
 # -------------------------------
 def extract_text_from_html(file_path: str) -> str:
     """Extracts text from an HTML file."""
+    from bs4 import BeautifulSoup
     with open(file_path, 'r', encoding='utf-8') as file:
         soup = BeautifulSoup(file, 'html.parser')
         # Remove script and style elements
@@ -218,70 +329,131 @@ def extract_texts(file_paths: list) -> dict:
 # -------------------------------
 
 def get_embedding(text):
-    response = requests.post(
-        "http://localhost:11434/api/embed",
-        json={"model": "mxbai-embed-large", "input": text}
-    )
-    return response.json()['embeddings']
+    return embedding_client.get_client().embed([text])
+
+
+def get_embeddings(texts):
+    """Embeds many texts with batched, concurrent /api/embed requests."""
+    return embedding_client.get_client().embed(texts)
 
 
 #print("Testing embedding" + str(get_embedding("Hello world!")))
 
+# -------------------------------
+# HASHING: content-addressed chunks & sources
+# -------------------------------
+
+RAG_CHUNKS_PATH = chunk_store.CHUNK_STORE_PATH
+MANIFEST_PATH = "ingest_manifest.json"
+
+# Bump whenever extraction, cleaning, chunking or chunk metadata changes so stored chunks are rebuilt.
+CHUNKER_VERSION = 5   # 5: no word-count estimate fallback; rebuild stores chunked without the tokenizer
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def source_fingerprint(file_path: str) -> str:
+    """Hash of the source file's bytes plus its SOURCE_METADATA entry."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    digest.update(json.dumps(SOURCE_METADATA.get(file_path), sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def assign_chunk_ids(records, seen=None):
+    """
+    Stable chunk ids derived from source + chunk text (+ occurrence for repeated text).
+    Pass the same `seen` dict across calls to number a source's chunks batch by batch.
+    """
+    seen = {} if seen is None else seen
+    for record in records:
+        record["chunk_hash"] = text_sha256(record["text"])
+        key = (record["source"], record["chunk_hash"])
+        occurrence = seen.get(key, 0)
+        seen[key] = occurrence + 1
+        record["id"] = text_sha256(f"{record['source']}\0{record['chunk_hash']}\0{occurrence}")[:32]
+    return records
+
+
+def load_manifest(path: str = MANIFEST_PATH) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def corpus_version(manifest: dict) -> str:
+    """Single hash identifying the ingested corpus; changes whenever any source is re-ingested."""
+    parts = [manifest.get("embed_model", ""), str(manifest.get("chunker_version", ""))]
+    for source, entry in sorted(manifest.get("sources", {}).items()):
+        parts.append(f"{source}:{entry['fingerprint']}")
+    return text_sha256("\n".join(parts))
+
+
+def get_corpus_version(path: str = MANIFEST_PATH) -> str:
+    return load_manifest(path).get("corpus_version", "")
+
+
 # -------------------------------
 # MAIN: ingest & chunk
 # -------------------------------
 
-def create_chunks():
-    all_chunks = []
-
-    # PDFs
-    for pdf_file in PDF_FILES:
-        text = extract_text_from_pdf(pdf_file)
-        chunks = chunk_text(text)
-        meta = SOURCE_METADATA[pdf_file]
-        for i, chunk in enumerate(chunks):
-            all_chunks.append({
-                "text": chunk,
-                "source": pdf_file,
-                "title": meta["title"],
-                "publisher": meta["publisher"],
-                "jurisdiction": meta["jurisdiction"],
-                "law_type": meta["law_type"],
-                "effective_date": meta["effective_date"],
-                "url": meta["url"],
-                "language": meta["language"],
-                "tags": meta["tags"],
-                "embedding": get_embedding(chunk)
-            })
-
-    # HTML
-    for html_file in HTML_FILES:
-        text = extract_text_from_html(html_file)
-        chunks = chunk_text(text)
-        meta = SOURCE_METADATA[html_file]
-        for i, chunk in enumerate(chunks):
-            all_chunks.append({
-                "text": chunk,
-                "source": pdf_file,
-                "title": meta["title"],
-                "publisher": meta["publisher"],
-                "jurisdiction": meta["jurisdiction"],
-                "law_type": meta["law_type"],
-                "effective_date": meta["effective_date"],
-                "url": meta["url"],
-                "language": meta["language"],
-                "tags": meta["tags"],
-                "embedding": get_embedding(chunk)
-            })
-    return all_chunks
+def build_chunk_record(file_path, chunk, page_start=None, page_end=None):
+    meta = SOURCE_METADATA[file_path]
+    record = {
+        "text": chunk,
+        "source": file_path,
+        "title": meta["title"],
+        "publisher": meta["publisher"],
+        "jurisdiction": meta["jurisdiction"],
+        "law_type": meta["law_type"],
+        "effective_date": meta["effective_date"],
+        "url": meta["url"],
+        "language": meta["language"],
+        "tags": meta["tags"],
+    }
+    if page_start is not None:
+        record["page_start"] = page_start
+        record["page_end"] = page_end
+    return record
+
+
+def iter_source_pages(file_path):
+    """(page number, text) pairs for a source; HTML sources are a single page."""
+    if file_path.lower().endswith('.pdf'):
+        yield from pdf_extraction.iter_pdf_pages(file_path)
+    elif file_path.lower().endswith('.htm') or file_path.lower().endswith('.html'):
+        yield 1, extract_text_from_html(file_path)
+    else:
+        print(f"Unsupported file format: {file_path}")
+
+
+def iter_source_chunks(file_path):
+    """Extract -> clean -> chunk, one chunk record at a time."""
+    pages = ((page_number, clean_text(text)) for page_number, text in iter_source_pages(file_path))
+    for chunk, page_start, page_end in chunk_pages(pages):
+        yield build_chunk_record(file_path, chunk, page_start, page_end)
 
 # -------------------------------
 # SAVE or INSERT into Vector DB
 # -------------------------------
 
-def create_rag_chunks():
-    all_chunks = create_chunks()
-    with open("rag_chunks.json", "w", encoding="utf-8") as f:
-        json.dump(all_chunks, f, indent=2, ensure_ascii=False)
+def iter_rag_chunks(path: str = RAG_CHUNKS_PATH):
+    """Streams stored chunk records out of the columnar chunk store."""
+    store = chunk_store.ChunkStore.open(path)
+    if store is not None:
+        yield from store.iter_records()
+
 
-    print(f"Completed ingestion: {len(all_chunks)} chunks ready for RAG pipeline!")
\ No newline at end of file
+def create_rag_chunks(force: bool = False) -> dict:
+    """
+    Runs the streaming ingestion pipeline; see ingest_pipeline.run_ingestion.
+    Returns the manifest describing the ingested corpus.
+    """
+    import ingest_pipeline
+    return ingest_pipeline.run_ingestion(force=force)
@@ -0,0 +1,183 @@
+"""
+Lightweight per-request tracing.
+
+A trace is one request (a chat answer, an assessment, a batch); spans are its stages
+(embedding, vector search, BM25, rerank, prompt rendering, generation) with their
+durations and attributes such as candidate counts and Ollama token counts. Spans recorded
+outside an active trace are dropped, so instrumented code costs next to nothing when
+nobody is tracing.
+
+Finished traces are kept in memory for the debug panel and Prometheus export, and are
+appended as JSON lines to TRACE_LOG_PATH when that environment variable is set. Set
+METRICS_PORT to serve /metrics (Prometheus text) and /traces (recent traces as JSON); the
+server listens on METRICS_HOST, localhost only unless that is set (e.g. to 0.0.0.0).
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TRACE_LOG_PATH = os.environ.get("TRACE_LOG_PATH")
+METRICS_PORT = os.environ.get("METRICS_PORT")
+# /traces exposes query text, so the endpoints are not published beyond this host by default
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+# Upper bounds (seconds) of the stage latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Trace:
+    def __init__(self, name, **attrs):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.spans = []
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self.seconds = None
+
+    def add_span(self, name, start, seconds, attrs):
+        self.spans.append({"name": name, "offset": start - self._t0, "seconds": seconds, **attrs})
+
+    def to_dict(self):
+        return {"trace_id": self.id, "name": self.name, "started": self.started, "seconds": self.seconds,
+                **self.attrs, "spans": list(self.spans)}
+
+
+class TraceRecorder:
+    """Keeps the most recent traces and running per-stage latency / token aggregates."""
+
+    def __init__(self, max_traces=200, log_path=TRACE_LOG_PATH):
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=max_traces)
+        self._stages = {}   # (trace name, span name) -> [count, sum, bucket counts]
+        self._counters = {"llm_prompt_tokens": 0, "llm_eval_tokens": 0}
+
+    def _observe(self, key, seconds):
+        stats = self._stages.setdefault(key, [0, 0.0, [0] * len(LATENCY_BUCKETS)])
+        stats[0] += 1
+        stats[1] += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                stats[2][i] += 1
+
+    def record(self, trace):
+        data = trace.to_dict()
+        with self._lock:
+            self._recent.append(data)
+            self._observe((trace.name, "total"), trace.seconds)
+            for span in trace.spans:
+                self._observe((trace.name, span["name"]), span["seconds"])
+                self._counters["llm_prompt_tokens"] += span.get("prompt_eval_count") or 0
+                self._counters["llm_eval_tokens"] += span.get("eval_count") or 0
+            if self.log_path:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(data) + "\n")
+
+    def recent(self, limit=20, **match):
+        """Most recent traces first, optionally only those whose attributes match `match`."""
+        with self._lock:
+            traces = list(self._recent)
+        traces = [t for t in reversed(traces) if all(t.get(k) == v for k, v in match.items())]
+        return traces[:limit]
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP compliance_stage_seconds Latency of each request stage.",
+            "# TYPE compliance_stage_seconds histogram",
+        ]
+        with self._lock:
+            for (trace_name, stage), (count, total, buckets) in sorted(self._stages.items()):
+                labels = f'request="{trace_name}",stage="{stage}"'
+                for bound, n in zip(LATENCY_BUCKETS, buckets):
+                    lines.append(f'compliance_stage_seconds_bucket{{{labels},le="{bound}"}} {n}')
+                lines.append(f'compliance_stage_seconds_bucket{{{labels},le="+Inf"}} {count}')
+                lines.append(f"compliance_stage_seconds_sum{{{labels}}} {total:.6f}")
+                lines.append(f"compliance_stage_seconds_count{{{labels}}} {count}")
+            for name, value in self._counters.items():
+                lines.append(f"# TYPE compliance_{name}_total counter")
+                lines.append(f"compliance_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+
+_recorder = TraceRecorder()
+
+
+def get_recorder() -> TraceRecorder:
+    return _recorder
+
+
+@contextmanager
+def start_trace(name, **attrs):
+    """Traces the enclosed request. Inside an already active trace this is just a span."""
+    if _current_trace.get() is not None:
+        with span(name, **attrs) as s:
+            yield s
+        return
+    trace = Trace(name, **attrs)
+    token = _current_trace.set(trace)
+    try:
+        yield trace.attrs
+    finally:
+        _current_trace.reset(token)
+        trace.seconds = time.perf_counter() - trace._t0
+        _recorder.record(trace)
+
+
+@contextmanager
+def span(name, **attrs):
+    """Times the enclosed stage; the yielded dict takes extra attributes (e.g. candidate counts)."""
+    trace = _current_trace.get()
+    start = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        if trace is not None:
+            trace.add_span(name, start, time.perf_counter() - start, attrs)
+
+
+def record_span(name, start, **attrs):
+    """Records a stage that began at perf_counter() value `start` (for generators, where `with` does not fit)."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, start, time.perf_counter() - start, attrs)
+
+
+def tracing_active():
+    return _current_trace.get() is not None
+
+
+# ---------- HTTP export ----------
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = _recorder.prometheus_text(), "text/plain; version=0.0.4"
+        elif self.path == "/traces":
+            body, content_type = json.dumps(_recorder.recent(limit=100)), "application/json"
+        else:
+            self.send_error(404)
+            return
+        payload = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_metrics(port, host=METRICS_HOST):
+    """Serves /metrics and /traces from a daemon thread; returns the server."""
+    server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
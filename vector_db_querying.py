@@ -1,163 +1,560 @@
-import chromadb
-from chromadb.config import Settings
-from chromadb.utils import embedding_functions
 import os
+import atexit
 import json
+import threading
 import uuid
-import re
+import hashlib
+import time
 import requests
-from rank_bm25 import BM25Okapi
-from sentence_transformers import CrossEncoder
+import numpy as np
 from datetime import datetime
 
-reranker = CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2")
+import embedding_client
+import text_extraction
+import terminology
+import tracing
+from feedback_index import get_feedback_index
+from keyword_index import KeywordIndex, scale_to_best
+from llm_scheduler import LLMScheduler
+from reranker import get_reranker
+from vector_index import ChromaBackend, load_numpy_index
+from retrieval_filters import TAG_PREFIX, effective_ts
 
 
 prompt_file_path = "prompts/geo_compliance_prompt.txt"
 
 
 # Setting up abbreviations
-def expand_abbreviations(text, glossary):
-
-    for abbr, definition in glossary.items():
-        pattern = r"\b" + re.escape(abbr) + r"\b"
-        replacement = f"{abbr} ({definition})"
-        text = re.sub(pattern, replacement, text)
-    return text
+def expand_abbreviations(text, glossary=None, tenant=None):
+    """
+    Expands every glossary term in one pass with the compiled terminology engine.
+    Uses the shared (or `tenant`'s) glossary unless an explicit `glossary` dict is given,
+    which is compiled for this call only.
+    """
+    if glossary is not None:
+        return terminology.TerminologyEngine(glossary).expand(text)
+    return terminology.expand(text, tenant)
 
 
 # Persistent Store
+CHROMA_PATH = "./chroma_store"
+COLLECTION_NAME = "geo_compliance_v2"
+UPSERT_BATCH_SIZE = 1000
+_chroma_client = None
+
+
+def get_chroma_client():
+    """One PersistentClient per process, shared by ingestion, querying and feedback."""
+    global _chroma_client
+    if _chroma_client is None:
+        import chromadb   # deferred: importing chromadb dominates this module's import time
+        _chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+    return _chroma_client
+
+
+def get_collection():
+    return get_chroma_client().get_or_create_collection(COLLECTION_NAME)
+
+
+def chunk_metadata(chunk):
+    metadata = {
+        "source": chunk["source"],
+        "title": chunk["title"],
+        "publisher": chunk.get("publisher"),
+        "jurisdiction": chunk.get("jurisdiction"),
+        "law_type": chunk.get("law_type"),
+        "effective_date": chunk.get("effective_date"),
+        "url": chunk.get("url"),
+        "language": chunk.get("language"),
+        "tags": ", ".join(chunk["tags"])
+    }
+    if chunk.get("page_start") is not None:
+        metadata["page_start"] = chunk["page_start"]
+        metadata["page_end"] = chunk["page_end"]
+    # Filterable forms: numeric date for range queries, one boolean key per tag
+    if chunk.get("effective_date"):
+        metadata["effective_ts"] = effective_ts(chunk["effective_date"])
+    for tag in chunk["tags"]:
+        metadata[TAG_PREFIX + tag] = True
+    return metadata
+
+
+def _batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def upsert_chunks(collection, chunks):
+    collection.upsert(
+        documents=[chunk["text"] for chunk in chunks],
+        embeddings=[chunk["embedding"] for chunk in chunks],
+        metadatas=[chunk_metadata(chunk) for chunk in chunks],
+        ids=[chunk["id"] for chunk in chunks]
+    )
+
+
 def set_up_chromadb():
+    """
+    Syncs geo_compliance_v2 with the stored chunks using stable chunk ids.
+    Ingestion normally writes to the collection itself, so this is a no-op unless the
+    collection has drifted from the manifest; then missing chunks are streamed in and
+    upserted in bulk, and chunks no longer in the corpus are deleted.
+    """
+    collection = get_collection()
+
+    manifest = text_extraction.load_manifest()
+    expected_ids = {
+        chunk_id
+        for entry in manifest.get("sources", {}).values()
+        for chunk_id in entry["chunk_ids"]
+    }
+    existing_ids = set(collection.get(include=[])["ids"])
+
+    if not expected_ids or expected_ids != existing_ids:
+        stale_ids = list(existing_ids - expected_ids) if expected_ids else []
+        for batch in _batched(stale_ids, UPSERT_BATCH_SIZE):
+            collection.delete(ids=batch)
+
+        new_chunks = (chunk for chunk in text_extraction.iter_rag_chunks() if chunk["id"] not in existing_ids)
+        upserted = 0
+        for batch in _batched(new_chunks, UPSERT_BATCH_SIZE):
+            upsert_chunks(collection, batch)
+            upserted += len(batch)
+        print(f"Chroma sync: upserted {upserted} chunks, removed {len(stale_ids)} stale chunks.")
+
+    stored = collection.get(include=["documents", "metadatas"])
+    documents = stored["documents"]
+
+    keyword_index = get_keyword_index()
+    if keyword_index.sync(stored["ids"], documents, stored["metadatas"]):
+        keyword_index.save(KEYWORD_INDEX_PATH)
+
+    return collection, Corpus(stored["ids"], documents)
+
+
+class Corpus(list):
+    """
+    Document texts in collection order (usable anywhere a list of documents was),
+    plus their chunk ids and a precomputed chunk id -> position map.
+    """
+
+    def __init__(self, ids, documents):
+        super().__init__(documents)
+        self.ids = list(ids)
+        self.positions = {chunk_id: i for i, chunk_id in enumerate(self.ids)}
 
-    client = chromadb.PersistentClient(path="./chroma_store")
+    def text(self, chunk_id):
+        return self[self.positions[chunk_id]]
 
-    collection = client.get_or_create_collection("geo_compliance_v2")
 
-    with open("rag_chunks.json", "r", encoding="utf-8") as f:
-        all_chunks = json.load(f)
+# Keyword index, built at ingestion and loaded lazily on first use
+KEYWORD_INDEX_PATH = "./chroma_store/keyword_index.json"
+_keyword_index = None
 
-    for chunk in all_chunks:
-        metadata = {
-            "source": chunk["source"],
-            "title": chunk["title"],
-            "publisher": chunk.get("publisher"),
-            "jurisdiction": chunk.get("jurisdiction"),
-            "law_type": chunk.get("law_type"),
-            "effective_date": chunk.get("effective_date"),
-            "url": chunk.get("url"),
-            "language": chunk.get("language"),
-            "tags": ", ".join(chunk["tags"])
-        }
 
-        collection.add(
-            documents=[chunk["text"]],
-            embeddings=chunk["embedding"],
-            metadatas=metadata,
-            ids=[chunk.get("id", str(uuid.uuid4()))]
-        )
-        documents = collection.get()["documents"]
+def get_keyword_index():
+    global _keyword_index
+    if _keyword_index is None:
+        with tracing.span("keyword_index_load"):
+            _keyword_index = KeywordIndex.load(KEYWORD_INDEX_PATH)
+    return _keyword_index
 
-    return collection, documents
+
+# In-process vector index over the chunk store, an alternative to querying Chroma
+_numpy_index = None
+# Vector backend used by hybrid search: "chroma" or "numpy"
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "chroma")
+
+
+def get_numpy_index():
+    global _numpy_index
+    if _numpy_index is None:
+        _numpy_index = load_numpy_index()
+    return _numpy_index
+
+
+def invalidate_numpy_index():
+    """Drops the loaded index so the next query maps the freshly ingested chunk store."""
+    global _numpy_index
+    _numpy_index = None
+
+
+def get_vector_backend(collection, name=None):
+    """"chroma" or "numpy" (VECTOR_BACKEND by default); numpy falls back to Chroma until a chunk store exists."""
+    name = name or VECTOR_BACKEND
+    if name == "numpy":
+        index = get_numpy_index()
+        if index is not None:
+            return index
+    elif name != "chroma":
+        raise ValueError(f"Unknown vector backend: {name!r}")
+    return ChromaBackend(collection)
 
 
 # ========== Embeddings ==========
 def get_embedding(text):
-    response = requests.post(
-        "http://localhost:11434/api/embed",
-        json={"model": "mxbai-embed-large", "input": text}
-    )
-    return response.json()['embeddings']
+    with tracing.span("embed", queries=1):
+        return embedding_client.get_client().embed([text])
 
 # ================================
 
 # ========== Hybrid Search ==========
-def hybrid_search(query, collection, all_documents, feedback_collection=None, top_k=5, alpha=0.7, beta = 0.2, gamma =0.1):
+def vector_candidates(query_embedding, collection, n, backend=None, filters=None):
+    """Top-n (chunk id, distance) pairs from the vector backend (VECTOR_BACKEND by default); smaller distance = closer."""
+    backend = backend or get_vector_backend(collection)
+    return backend.query(query_embedding, n, filters)[0]
 
-        # 1. Semantic search via Chroma
-    query_embedding = get_embedding(query)
-    vector_results = collection.query(
-        query_embeddings=query_embedding,
-        n_results=top_k * 2   # grab more for reranking
-    )
 
-    vector_docs = vector_results["documents"][0]
-    vector_scores = vector_results["distances"][0]  # smaller = closer
-    vector_scores = [1.0 - (s / max(vector_scores)) for s in vector_scores]  # normalize
+def keyword_candidates(query, n, filters=None):
+    """Top-n (chunk id, bm25 score) pairs from the keyword index."""
+    return get_keyword_index().top_n(query, n, filters)
+
 
-    # 2. Keyword search via BM25
-    tokenized_docs = [doc.split() for doc in all_documents]
-    bm25 = BM25Okapi(tokenized_docs)
-    keyword_scores = bm25.get_scores(query.split())
+def _min_max(scores):
+    if not scores:
+        return {}
+    lo, hi = min(scores.values()), max(scores.values())
+    if hi == lo:
+        return {chunk_id: 1.0 for chunk_id in scores}
+    return {chunk_id: (s - lo) / (hi - lo) for chunk_id, s in scores.items()}
 
-    # pick same candidates as vector (union)
-    candidate_set = set(vector_docs)
-    candidates = list(candidate_set)
 
-    # 3. Fuse scores
-    fused_results = []
-    for doc in candidates:
-        v_score = vector_scores[vector_docs.index(doc)] if doc in vector_docs else 0
-        k_score = keyword_scores[all_documents.index(doc)] if doc in all_documents else 0
-        #if feedback_collection and doc in feedback_collection:
-        #    f_score = feedback_collection[doc]
-        #else:
-        f_score = 1  # set to 1 just for an example, to represent 1 good user feedback.
+def _reciprocal_ranks(hits, k):
+    return {chunk_id: 1.0 / (k + rank) for rank, (chunk_id, _) in enumerate(hits, start=1)}
 
-        final_score = alpha * v_score + beta * k_score + gamma * f_score
-        fused_results.append((doc, final_score))
 
-    # 4. Sort & return top_k
-    fused_results = sorted(fused_results, key=lambda x: x[1], reverse=True)[:top_k]
-    return [doc for doc, _ in fused_results]
+def fuse_candidates(vector_hits, keyword_hits, alpha=0.7, beta=0.2, gamma=0.1, feedback_scores=None, fusion="linear", rrf_k=60):
+    """
+    Fuses vector and keyword hits keyed by chunk id over the union of both lists.
+    fusion="linear": min-max normalise each retriever's scores, then weight by alpha/beta.
+    fusion="rrf": weighted reciprocal-rank fusion, alpha/(rrf_k + rank_v) + beta/(rrf_k + rank_k).
+    gamma weights each chunk's feedback score, looked up in `feedback_scores` (a chunk id -> score
+    mapping; the shared feedback index by default).
+    Returns [(chunk id, fused score)] sorted best first.
+    """
+    if feedback_scores is None:
+        feedback_scores = get_feedback_index().scores
+    if fusion == "rrf":
+        v_scores = _reciprocal_ranks(vector_hits, rrf_k)
+        k_scores = _reciprocal_ranks(keyword_hits, rrf_k)
+    elif fusion == "linear":
+        v_scores = _min_max({chunk_id: -distance for chunk_id, distance in vector_hits})
+        k_scores = _min_max(dict(keyword_hits))
+    else:
+        raise ValueError(f"Unknown fusion method: {fusion!r}")
+
+    fused = []
+    for chunk_id in v_scores.keys() | k_scores.keys():
+        f_score = feedback_scores.get(chunk_id, 0.0)
+        final_score = alpha * v_scores.get(chunk_id, 0.0) + beta * k_scores.get(chunk_id, 0.0) + gamma * f_score
+        fused.append((chunk_id, final_score))
+
+    return sorted(fused, key=lambda x: x[1], reverse=True)
+
+
+def lookup_documents(chunk_ids, collection, all_documents, session_layer=None):
+    """Chunk texts for the given ids, via the corpus id map when available."""
+    if session_layer:
+        session_texts = {chunk_id: session_layer.text(chunk_id) for chunk_id in chunk_ids}
+        base_ids = [chunk_id for chunk_id in chunk_ids if session_texts[chunk_id] is None]
+        base_texts = dict(zip(base_ids, lookup_documents(base_ids, collection, all_documents))) if base_ids else {}
+        return [session_texts[chunk_id] if session_texts[chunk_id] is not None else base_texts[chunk_id]
+                for chunk_id in chunk_ids]
+    if isinstance(all_documents, Corpus) and all(chunk_id in all_documents.positions for chunk_id in chunk_ids):
+        return [all_documents.text(chunk_id) for chunk_id in chunk_ids]
+    fetched = collection.get(ids=list(chunk_ids), include=["documents"])
+    by_id = dict(zip(fetched["ids"], fetched["documents"]))
+    return [by_id[chunk_id] for chunk_id in chunk_ids]
+
+
+def hybrid_search_ids(query, collection, all_documents, feedback_collection=None, top_k=5, alpha=0.7, beta=0.2, gamma=0.1,
+                      fusion="linear", candidates_per_retriever=None, query_embedding=None, backend=None, filters=None,
+                      session_layer=None):
+    """
+    Like hybrid_search, but returns [(chunk id, text, fused score)].
+    `feedback_collection` maps chunk ids to feedback scores (defaults to the shared feedback index).
+    `filters` (a RetrievalFilter) is applied inside both retrievers, before scoring.
+    `session_layer` (a session_index.SessionLayer) adds the session's uploaded policies as
+    extra candidates in both retrievers; filters do not apply to them.
+    """
+    if query_embedding is None:
+        query_embedding = get_embedding(query)
+    return hybrid_search_batch([query], collection, all_documents, feedback_collection, top_k, alpha, beta, gamma,
+                               fusion, candidates_per_retriever, np.atleast_2d(query_embedding), backend, filters,
+                               session_layer)[0]
+
+
+def hybrid_search_batch(queries, collection, all_documents, feedback_collection=None, top_k=5, alpha=0.7, beta=0.2, gamma=0.1,
+                        fusion="linear", candidates_per_retriever=None, query_embeddings=None, backend=None, filters=None,
+                        session_layer=None):
+    """
+    hybrid_search_ids for several queries at once: one embedding request, one multi-vector
+    backend query, keyword scoring against the shared index with the filter evaluated once,
+    and one text lookup for the union of the winners. Returns one result list per query.
+    """
+    queries = list(queries)
+    if not queries:
+        return []
+    n = candidates_per_retriever or top_k * 2   # grab more for reranking
+
+    # 1. Semantic search via the vector backend (VECTOR_BACKEND unless another is given)
+    if query_embeddings is None:
+        with tracing.span("embed", queries=len(queries)):
+            query_embeddings = embedding_client.get_client().embed(queries)
+    backend = backend or get_vector_backend(collection)
+    with tracing.span("vector_search", backend=backend.name, queries=len(queries)) as stage:
+        vector_lists = backend.query(query_embeddings, n, filters)
+        stage["candidates"] = sum(len(hits) for hits in vector_lists)
+
+    # 2. Keyword search via the prebuilt BM25 index (only postings of query terms are scored)
+    keyword_index = get_keyword_index()
+    with tracing.span("keyword_search", queries=len(queries)) as stage:
+        keyword_lists = keyword_index.top_n_batch(queries, n, filters)
+        stage["candidates"] = sum(len(hits) for hits in keyword_lists)
+
+    fusion_start = time.perf_counter()
+    fused_lists = []
+    for query, query_embedding, vector_hits, keyword_hits in zip(queries, query_embeddings, vector_lists, keyword_lists):
+        # Merge in the session's uploaded policies, converting their distances to the backend's units
+        # and scaling BM25 scores per index (each has its own IDF) before merging
+        if session_layer:
+            scale = backend.cosine_distance_scale
+            session_hits = [(chunk_id, d * scale) for chunk_id, d in session_layer.vector_hits(query_embedding, n)]
+            vector_hits = sorted(vector_hits + session_hits, key=lambda hit: hit[1])[:n]
+            keyword_hits = sorted(scale_to_best(keyword_hits) + session_layer.keyword_hits(query, n),
+                                  key=lambda hit: hit[1], reverse=True)[:n]
+
+        # 3. Fuse scores over the union of both candidate lists
+        fused_lists.append(fuse_candidates(vector_hits, keyword_hits, alpha, beta, gamma, feedback_collection, fusion=fusion)[:top_k])
+    tracing.record_span("fusion", fusion_start, method=fusion, session_layer=bool(session_layer))
+
+    # 4. Resolve texts for the winners only
+    ids = list(dict.fromkeys(chunk_id for fused in fused_lists for chunk_id, _ in fused))
+    with tracing.span("lookup", chunks=len(ids)):
+        texts = dict(zip(ids, lookup_documents(ids, collection, all_documents, session_layer)))
+    return [[(chunk_id, texts[chunk_id], score) for chunk_id, score in fused] for fused in fused_lists]
+
+
+def hybrid_search(query, collection, all_documents, feedback_collection=None, top_k=5, alpha=0.7, beta = 0.2, gamma =0.1, fusion="linear", backend=None, filters=None):
+    results = hybrid_search_ids(query, collection, all_documents, feedback_collection, top_k, alpha, beta, gamma,
+                                fusion=fusion, backend=backend, filters=filters)
+    return [text for _, text, _ in results]
 
 # ================================
 
 # ========== Reranked ==========
-def rerank_results(query, retrieved_chunks):
-    pairs = [(query, chunk) for chunk in retrieved_chunks]
-    scores = reranker.predict(pairs)
-    reranked = [chunk for _, chunk in sorted(zip(scores, retrieved_chunks), reverse=True)]
-    return reranked
+def rerank_results(query, retrieved_chunks, chunk_ids=None):
+    return get_reranker().rerank(query, retrieved_chunks, chunk_ids)
+
+
+def rerank_results_batch(queries, retrieved_chunk_lists, chunk_id_lists=None):
+    """rerank_results for several queries; every (query, chunk) pair is scored in one batched forward pass."""
+    return get_reranker().rerank_batch(queries, retrieved_chunk_lists, chunk_id_lists)
 # ================================
 
 
 
 # ========== Querying Function ==========
-def query_ollama(query, expanded_query, model, collection, documents, prompt_file_path):
+OLLAMA_URL = "http://localhost:11434"
+_prompt_templates = {}
 
-    retrieved_chunks = hybrid_search(query, collection, documents, top_k=5, alpha=0.7)
-    reranked_chunks = rerank_results(query, retrieved_chunks)
-    context = "\n\n".join(reranked_chunks[:3])
 
-    with open(prompt_file_path, "r", encoding="utf-8") as f:
-        prompt_template = f.read()
+def load_prompt_template(prompt_file_path):
+    """Reads the prompt template once, re-reading only if the file changes."""
+    mtime = os.path.getmtime(prompt_file_path)
+    cached = _prompt_templates.get(prompt_file_path)
+    if cached is None or cached[0] != mtime:
+        with open(prompt_file_path, "r", encoding="utf-8") as f:
+            cached = (mtime, f.read())
+        _prompt_templates[prompt_file_path] = cached
+    return cached[1]
 
-    prompt = prompt_template.format(
+
+def build_prompt(query, expanded_query, context, prompt_file_path):
+    return load_prompt_template(prompt_file_path).format(
         query=query,
         expanded_query=expanded_query,
         context=context
     )
 
-    response = requests.post(
-        "http://localhost:11434/api/generate",
-        json={
-                "model": model, 
-                "prompt": prompt, 
-                "temperature": 0.1, 
-                "format": "json", 
-                "max_tokens": 700
+
+# JSON schema of the structured assessment, passed to Ollama as `format` to constrain decoding
+RESULTS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "implications": {"type": "string"},
+        "results": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "law": {"type": "string"},
+                    "reasoning": {"type": "string"},
+                    "highlight": {"type": "string"},
+                    "supporting_text": {"type": "string"},
+                    "confidence": {"type": "integer", "minimum": 1, "maximum": 10},
+                },
+                "required": ["law", "reasoning", "highlight", "supporting_text", "confidence"],
             },
-        stream=True,
-    )
-    output = ""
-    for line in response.iter_lines():
-        if line:
-            data = json.loads(line.decode("utf-8"))
-            if "response" in data:
-                output += data["response"]
-            if data.get("done", False):
-                break
-    return output
+        },
+    },
+    "required": ["implications", "results"],
+}
+
+
+# How long Ollama keeps the model loaded after a request, so bursts do not pay for reloads
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+# (connect, read) seconds; the read timeout bounds the wait for each streamed line
+OLLAMA_TIMEOUT = (10, 300)
+# Context window requested from Ollama (its default is far smaller and truncates prompts silently).
+# Every request uses the same value so Ollama does not reload the model between requests.
+LLM_NUM_CTX = int(os.environ.get("LLM_NUM_CTX", "16384"))
+LLM_NUM_PREDICT = 700
+# Prompts are measured with the embedding tokenizer; the LLM's tokenizer may split text finer
+LLM_TOKEN_MARGIN = 1.25
+
+
+def prompt_token_budget():
+    """Largest prompt (in text_extraction.count_tokens tokens) that fits LLM_NUM_CTX next to the answer."""
+    return int((LLM_NUM_CTX - LLM_NUM_PREDICT) / LLM_TOKEN_MARGIN)
+
+
+def generation_request(model, prompt, output_format=RESULTS_SCHEMA):
+    """
+    Body for Ollama's /api/generate; sampling settings belong under "options".
+    Raises ValueError if the prompt would not fit the context window, instead of letting Ollama cut it.
+    """
+    prompt_tokens = text_extraction.count_tokens(prompt)
+    if prompt_tokens > prompt_token_budget():
+        raise ValueError(f"Prompt is ~{prompt_tokens} tokens but only {prompt_token_budget()} fit in "
+                         f"num_ctx={LLM_NUM_CTX}; raise LLM_NUM_CTX or shorten the input")
+    return {
+        "model": model,
+        "prompt": prompt,
+        "format": output_format,
+        "options": {"temperature": 0.1, "num_predict": LLM_NUM_PREDICT, "num_ctx": LLM_NUM_CTX},
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+    }
+
+
+def preload_model(model):
+    """Loads `model` into Ollama (a generate request without a prompt) and keeps it warm."""
+    requests.post(
+        f"{OLLAMA_URL}/api/generate",
+        json={"model": model, "keep_alive": OLLAMA_KEEP_ALIVE, "options": {"num_ctx": LLM_NUM_CTX}},
+        timeout=300,
+    ).raise_for_status()
+
+
+def prompt_template_hash(prompt_file_path):
+    return hashlib.sha256(load_prompt_template(prompt_file_path).encode("utf-8")).hexdigest()
+
+
+def retrieve_chunks(query, collection, documents, top_k=5, context_k=3, query_embedding=None, filters=None, session_layer=None):
+    """The context_k best reranked chunks as [(chunk id, text)], so answers can be traced back to their sources."""
+    if query_embedding is None:
+        query_embedding = get_embedding(query)
+    return retrieve_chunks_batch([query], collection, documents, top_k, context_k, np.atleast_2d(query_embedding),
+                                 filters, session_layer)[0]
+
+
+def retrieve_chunks_batch(queries, collection, documents, top_k=5, context_k=3, query_embeddings=None, filters=None,
+                          session_layer=None):
+    """retrieve_chunks for several queries: batched hybrid search, then one batched rerank."""
+    retrieved = hybrid_search_batch(queries, collection, documents, top_k=top_k, alpha=0.7, query_embeddings=query_embeddings,
+                                    filters=filters, session_layer=session_layer)
+    id_lists = [[chunk_id for chunk_id, _, _ in results] for results in retrieved]
+    text_lists = [[text for _, text, _ in results] for results in retrieved]
+    with tracing.span("rerank", pairs=sum(len(ids) for ids in id_lists)):
+        score_lists = get_reranker().score_batch(queries, text_lists, id_lists)
+    chunks = []
+    for ids, texts, scores in zip(id_lists, text_lists, score_lists):
+        order = sorted(range(len(ids)), key=lambda i: scores[i], reverse=True)
+        chunks.append([(ids[i], texts[i]) for i in order[:context_k]])
+    return chunks
+
+
+def retrieve_context(query, collection, documents, top_k=5, context_k=3, query_embedding=None, filters=None, session_layer=None):
+    chunks = retrieve_chunks(query, collection, documents, top_k, context_k, query_embedding, filters, session_layer)
+    return "\n\n".join(text for _, text in chunks)
+
+
+def _ollama_generate(body, on_token):
+    """Runs one streamed generation (on a scheduler worker); returns Ollama's final stats."""
+    response = requests.post(f"{OLLAMA_URL}/api/generate", json=body, stream=True, timeout=OLLAMA_TIMEOUT)
+    with response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if line:
+                data = json.loads(line.decode("utf-8"))
+                if data.get("response"):
+                    on_token(data["response"])
+                if data.get("done", False):
+                    return ollama_stats(data)
+    return {}
+
+
+_llm_scheduler = None
+_llm_scheduler_lock = threading.Lock()
+
+
+def get_llm_scheduler():
+    """Process-wide generation scheduler: bounded concurrency, fair per-session queue, singleflight."""
+    global _llm_scheduler
+    with _llm_scheduler_lock:
+        if _llm_scheduler is None:
+            _llm_scheduler = LLMScheduler(_ollama_generate)
+        return _llm_scheduler
+
+
+def stream_generate(model, prompt):
+    """
+    Yields response tokens as Ollama emits them, through the shared scheduler.
+    Records a "generate" span with queue wait, time to first token, whether the request
+    joined an identical in-flight generation, and Ollama's token counts and durations.
+    """
+    start = time.perf_counter()
+    flight, joined = get_llm_scheduler().submit(generation_request(model, prompt))
+    stats = {"model": model, "ttft": None, "joined": joined}
+    try:
+        for token in flight:
+            if stats["ttft"] is None:
+                stats["ttft"] = time.perf_counter() - start
+            yield token
+        stats.update(flight.stats)
+    finally:
+        if flight.started is not None:
+            stats["queue_wait"] = max(0.0, flight.started - start)
+        tracing.record_span("generate", start, **stats)
+
+
+def ollama_stats(done_message):
+    """Token counts (and durations in seconds) from the final message of an Ollama generation."""
+    stats = {key: done_message[key] for key in ("prompt_eval_count", "eval_count") if key in done_message}
+    for key in ("load_duration", "prompt_eval_duration", "eval_duration"):
+        if key in done_message:
+            stats[key] = done_message[key] / 1e9   # Ollama reports nanoseconds
+    return stats
+
+
+def stream_ollama(query, expanded_query, model, collection, documents, prompt_file_path, query_embedding=None):
+    """Retrieves context, then yields the answer token by token."""
+    context = retrieve_context(query, collection, documents, query_embedding=query_embedding)
+    with tracing.span("prompt_render"):
+        prompt = build_prompt(query, expanded_query, context, prompt_file_path)
+    yield from stream_generate(model, prompt)
+
+
+def query_ollama(query, expanded_query, model, collection, documents, prompt_file_path, query_embedding=None):
+    with tracing.start_trace("query_ollama", model=model):
+        return "".join(stream_ollama(query, expanded_query, model, collection, documents, prompt_file_path, query_embedding))
 # ===================================
 
 
@@ -165,26 +562,87 @@ def query_ollama(query, expanded_query, model, collection, documents, prompt_fil
 
 # ========== Save Feedback ==========
 
-def save_feedback_to_chroma(feedback, client_path="./chroma_store"):
+FEEDBACK_COLLECTION = "geo_feedback"
+FEEDBACK_FLUSH_SIZE = 16
+# Longest a rating waits in the buffer, so a crash loses at most this many seconds of feedback
+FEEDBACK_FLUSH_SECONDS = 2.0
+_pending_feedback = []
+_pending_feedback_lock = threading.Lock()
+_feedback_timer = None
+
+
+def save_feedback_to_chroma(feedback, flush=False):
+    """
+    Records one feedback entry. The rating is applied to the per-chunk feedback scores
+    immediately; the entry itself (query, answer, rating, comments and the chunk ids that
+    were used) is buffered and written to the feedback collection in batches, every
+    FEEDBACK_FLUSH_SIZE entries or FEEDBACK_FLUSH_SECONDS after the first buffered one.
+    """
+    global _feedback_timer
+    get_feedback_index().record(feedback.get("chunk_ids") or [], feedback["rating"])
+    with _pending_feedback_lock:
+        _pending_feedback.append(feedback)
+        due = flush or len(_pending_feedback) >= FEEDBACK_FLUSH_SIZE
+        if not due and _feedback_timer is None:
+            _feedback_timer = threading.Timer(FEEDBACK_FLUSH_SECONDS, flush_feedback)
+            _feedback_timer.daemon = True
+            _feedback_timer.start()
+    if due:
+        flush_feedback()
+
+
+def flush_feedback():
+    """
+    Writes buffered feedback entries with one embed call and one add, through the shared client.
+    If the write fails, the entries go back into the buffer for the next flush.
+    """
+    global _feedback_timer
+    with _pending_feedback_lock:
+        batch = list(_pending_feedback)
+        _pending_feedback.clear()
+        if _feedback_timer is not None:
+            _feedback_timer.cancel()
+            _feedback_timer = None
+    if not batch:
+        return
+    get_feedback_index().flush()
+    try:
+        _write_feedback(batch)
+    except Exception:
+        with _pending_feedback_lock:
+            _pending_feedback[:0] = batch
+        raise
+
+
+def _write_feedback(batch):
+    get_chroma_client().get_or_create_collection(FEEDBACK_COLLECTION).add(
+        ids=[str(uuid.uuid4()) for _ in batch],
+        documents=[entry["answer"] for entry in batch],
+        embeddings=embedding_client.get_client().embed([entry["query"] for entry in batch]),
+        metadatas=[{
+            "query": entry["query"],
+            "rating": int(entry["rating"]),
+            "comments": entry.get("comments") or "",
+            "chunk_ids": ",".join(entry.get("chunk_ids") or []),
+            "timestamp": entry.get("timestamp") or datetime.utcnow().isoformat(),
+        } for entry in batch],
+    )
 
-        client = chromadb.PersistentClient(path=client_path)
-        feedback_col = client.get_or_create_collection("geo_feedback")
 
-        feedback_col.add(
-            documents=[feedback["answer"]],
-            embeddings=get_embedding(feedback["query"]),
-            ids=[str(uuid.uuid4())]
-        )
+atexit.register(flush_feedback)
 
 # ===================================
 
 # ========== Query + Feedback ==========
-def query_with_feedback(query, expanded_query, model, documents, prompt_file_path):
+def query_with_feedback(query, expanded_query, model, documents, prompt_file_path, collection=None):
     """
-    Run query through RAG pipeline, collect human feedback, and store in ChromaDB.
+    Run query through RAG pipeline, collect human feedback, and store it against the chunks that were used.
     """
     # 1. Get model answer
-    answer = query_ollama(query, expanded_query, model, documents, prompt_file_path)
+    collection = collection or get_collection()
+    chunks = retrieve_chunks(query, collection, documents)
+    prompt = build_prompt(query, expanded_query, "\n\n".join(text for _, text in chunks), prompt_file_path)
+    answer = "".join(stream_generate(model, prompt))
     print("\n--- Response ---")
     print(answer)
 
@@ -202,6 +660,7 @@ def query_with_feedback(query, expanded_query, model, documents, prompt_file_pat
         "answer": answer,
         "rating": 1 if feedback_rating == "u" else -1,
         "comments": feedback_text,
+        "chunk_ids": [chunk_id for chunk_id, _ in chunks],
         "timestamp": datetime.utcnow().isoformat()
     }
 
@@ -220,5 +679,13 @@ def query_with_feedback(query, expanded_query, model, documents, prompt_file_pat
 
 #     answer = query_with_feedback(query_1, expanded_query, model="gemma3", documents=all_documents, prompt_file_path="prompts/geo_compliance_prompt.txt")
 
-with open("data_sources/terminology.json", "r", encoding="utf-8") as f:
-    glossary = json.load(f)
\ No newline at end of file
+def get_glossary(tenant=None):
+    """Abbreviation glossary, read on first use and re-read when the file changes."""
+    return terminology.get_terminology_store().get(tenant).glossary
+
+
+def __getattr__(name):
+    # Keeps `vdb.glossary` working without reading the file at import time
+    if name == "glossary":
+        return get_glossary()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
@@ -0,0 +1,113 @@
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+import chunk_store
+
+
+class VectorBackend(ABC):
+    """
+    Minimal interface hybrid search needs from a vector store.
+    query() takes one or more query vectors (and an optional RetrievalFilter) and returns,
+    per query, a list of (chunk id, distance) pairs sorted closest first.
+    `cosine_distance_scale` converts a cosine distance (1 - cos) of unit vectors into this
+    backend's distance units, so hits from other indexes can be merged into its lists.
+    """
+
+    name = "base"
+    cosine_distance_scale = 1.0
+
+    @abstractmethod
+    def query(self, query_embeddings, n_results, filters=None):
+        ...
+
+
+class ChromaBackend(VectorBackend):
+    name = "chroma"
+    # Chroma's default space is squared L2, which is 2 * (1 - cos) for unit-normalised embeddings
+    cosine_distance_scale = 2.0
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def query(self, query_embeddings, n_results, filters=None):
+        results = self.collection.query(
+            query_embeddings=np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)).tolist(),
+            n_results=n_results,
+            where=filters.chroma_where() if filters else None,
+            include=["distances"]
+        )
+        return [list(zip(ids, distances)) for ids, distances in zip(results["ids"], results["distances"])]
+
+
+class NumpyVectorIndex(VectorBackend):
+    """
+    Exact in-process search over the chunk embedding matrix.
+    metric="ip" (the default) searches the (memory-mapped) matrix as is, which equals cosine
+    for Ollama's unit-normalised embeddings; metric="cosine" keeps a row-normalised float32
+    copy for embeddings that are not. Distances are 1 - similarity, so smaller = closer.
+    Several query vectors are scored in a single matmul.
+    """
+
+    name = "numpy"
+
+    def __init__(self, embeddings, ids, metric="ip", documents=None, row_docs=None):
+        if metric not in ("cosine", "ip"):
+            raise ValueError(f"Unknown metric: {metric!r}")
+        self.metric = metric
+        self.ids = list(ids)
+        # Per-document metadata and each row's document index, for filter masks
+        self.documents = documents or []
+        self.row_docs = np.asarray(row_docs if row_docs is not None else [], dtype=np.int64)
+        if metric == "cosine":
+            matrix = np.asarray(embeddings, dtype=np.float32)
+            self.matrix = matrix / (np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12)
+        else:
+            self.matrix = embeddings if isinstance(embeddings, np.ndarray) else np.asarray(embeddings, dtype=np.float32)
+
+    @classmethod
+    def from_chunk_store(cls, store, metric="ip"):
+        return cls(store.embeddings, store.ids, metric, store.documents, store.table["doc"])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def similarities(self, query_embeddings):
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        if self.metric == "cosine":
+            queries = queries / (np.linalg.norm(queries, axis=1, keepdims=True) + 1e-12)
+        return queries @ self.matrix.T
+
+    def mask_for(self, filters):
+        """Boolean row mask for a RetrievalFilter, evaluated once per document."""
+        if not self.documents:
+            raise ValueError("This index has no document metadata to filter on")
+        doc_ok = np.array([filters.matches(doc) for doc in self.documents], dtype=bool)
+        return doc_ok[self.row_docs]
+
+    def query(self, query_embeddings, n_results, filters=None, mask=None):
+        """`filters` (a RetrievalFilter) or `mask` restrict the search to matching rows."""
+        if not self.ids:
+            return [[] for _ in np.atleast_2d(query_embeddings)]
+        if filters:
+            mask = self.mask_for(filters) if mask is None else mask & self.mask_for(filters)
+        scores = self.similarities(query_embeddings)
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+            n_results = min(n_results, int(np.count_nonzero(mask)))
+        n_results = min(n_results, len(self.ids))
+        if n_results <= 0:
+            return [[] for _ in scores]
+
+        top = np.argpartition(-scores, n_results - 1, axis=1)[:, :n_results]
+        results = []
+        for row_scores, row_top in zip(scores, top):
+            ordered = row_top[np.argsort(-row_scores[row_top])]
+            results.append([(self.ids[i], float(1.0 - row_scores[i])) for i in ordered])
+        return results
+
+
+def load_numpy_index(path=chunk_store.CHUNK_STORE_PATH, metric="ip"):
+    """NumpyVectorIndex over the ingested chunk store, or None if nothing is ingested."""
+    store = chunk_store.ChunkStore.open(path)
+    return NumpyVectorIndex.from_chunk_store(store, metric) if store is not None else None
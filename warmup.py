@@ -0,0 +1,129 @@
+"""
+Preloads the heavy resources behind the checker and reports how long each one took.
+
+Everything expensive (Chroma, the corpus, tokenizers, the reranker, the glossary and the
+Ollama models) is loaded lazily on first use; this script loads them on purpose so the
+first real request does not pay for them. Run it after deploying or re-ingesting:
+
+    python warmup.py
+    python warmup.py --skip llm reranker --json
+"""
+import argparse
+import importlib
+import json
+import threading
+import time
+
+
+_search_resources = None
+_search_resources_lock = threading.Lock()
+
+
+def search_resources():
+    """(collection, documents) for retrieval, ingesting first if the corpus is stale. Built once per process."""
+    global _search_resources
+    with _search_resources_lock:
+        if _search_resources is None:
+            import text_extraction
+            import vector_db_querying as vdb
+            text_extraction.create_rag_chunks()
+            _search_resources = vdb.set_up_chromadb()
+        return _search_resources
+
+
+def _import_modules():
+    for name in ("vector_db_querying", "text_extraction", "assessment"):
+        importlib.import_module(name)
+
+
+def _sentence_models():
+    import text_extraction
+    text_extraction.chunk_text("Warm up. Sentence models and the embedding tokenizer.")
+
+
+def _keyword_index():
+    import vector_db_querying as vdb
+    vdb.get_keyword_index()
+
+
+def _numpy_index():
+    import vector_db_querying as vdb
+    vdb.get_numpy_index()
+
+
+def _glossary():
+    import terminology
+    terminology.get_terminology_store().get()
+
+
+def _reranker():
+    from reranker import get_reranker
+    get_reranker().model.predict([("warm up", "warm up")], show_progress_bar=False)
+
+
+def _embedding_model():
+    import embedding_client
+    embedding_client.get_client().embed_one("warm up")
+
+
+def _llm():
+    import vector_db_querying as vdb
+    from assessment import LLM_MODEL
+    vdb.preload_model(LLM_MODEL)
+
+
+WARM_UP_STEPS = {
+    "imports": _import_modules,
+    "corpus": search_resources,
+    "keyword index": _keyword_index,
+    "numpy index": _numpy_index,
+    "glossary": _glossary,
+    "tokenizers": _sentence_models,
+    "reranker": _reranker,
+    "embedding model": _embedding_model,
+    "llm": _llm,
+}
+
+# Most recent warm-up report, [{"step", "seconds", "error"}]
+last_report = []
+
+
+def warm_up(steps=None, skip=()):
+    """Runs the warm-up steps in order; a failing step is reported and does not stop the rest."""
+    global last_report
+    report = []
+    for name in steps or WARM_UP_STEPS:
+        if name in skip:
+            continue
+        start = time.perf_counter()
+        error = None
+        try:
+            WARM_UP_STEPS[name]()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        report.append({"step": name, "seconds": time.perf_counter() - start, "error": error})
+    last_report = report
+    return report
+
+
+def format_report(report):
+    lines = [f"{'step':<16} {'seconds':>9}"]
+    for row in report:
+        status = f"  FAILED ({row['error']})" if row["error"] else ""
+        lines.append(f"{row['step']:<16} {row['seconds']:9.3f}{status}")
+    lines.append(f"{'total':<16} {sum(row['seconds'] for row in report):9.3f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--skip", nargs="*", default=[], choices=list(WARM_UP_STEPS), help="steps to leave cold")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = warm_up(skip=set(args.skip))
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+
+
+if __name__ == "__main__":
+    main()